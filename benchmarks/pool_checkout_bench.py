@@ -0,0 +1,119 @@
+"""
+PooledDB 取出/归还连接的并发基准测试
+
+使用内存中的假 DB-API 模块, 只测量连接池本身的开销(锁竞争和数据结构), 不访问数据库.
+
+    python benchmarks/pool_checkout_bench.py
+    python benchmarks/pool_checkout_bench.py --threads 1 8 64 --seconds 3 --mode shared
+    python benchmarks/pool_checkout_bench.py --maxconnections 64 --maxshared 64 --latency 0.0002
+
+--latency 模拟 rollback 和 ping 的网络往返时间(秒)
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pcs.extensions.db_link_extension.pooled_db import PooledDB  # noqa: E402
+
+
+class FakeDB:
+    """满足 SteadyDB 要求的最小 DB-API 模块"""
+    threadsafety = 2
+    latency = 0
+
+    class OperationalError(Exception):
+        pass
+
+    class InterfaceError(Exception):
+        pass
+
+    class InternalError(Exception):
+        pass
+
+    class Cursor:
+        def execute(self, *args, **kwargs):
+            pass
+
+        def close(self):
+            pass
+
+    class Connection:
+        def cursor(self, *args, **kwargs):
+            return FakeDB.Cursor()
+
+        def commit(self):
+            pass
+
+        def rollback(self):
+            if FakeDB.latency:
+                time.sleep(FakeDB.latency)
+
+        def close(self):
+            pass
+
+        def ping(self, *args):
+            if FakeDB.latency:
+                time.sleep(FakeDB.latency)
+            return True
+
+    @staticmethod
+    def connect(*args, **kwargs):
+        return FakeDB.Connection()
+
+
+def run(pool, threads, seconds, shareable):
+    counts = [0] * threads
+    stop = threading.Event()
+    start = threading.Barrier(threads + 1)
+
+    def worker(index):
+        connection = pool.connection
+        start.wait()
+        n = 0
+        while not stop.is_set():
+            con = connection(shareable)
+            con.close()
+            n += 1
+        counts[index] = n
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for t in workers:
+        t.start()
+    start.wait()
+    time.sleep(seconds)
+    stop.set()
+    for t in workers:
+        t.join()
+    return sum(counts) / seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32, 64])
+    parser.add_argument('--seconds', type=float, default=2.0)
+    parser.add_argument('--mode', choices=['dedicated', 'shared', 'all'], default='all')
+    parser.add_argument('--maxconnections', type=int, default=16)
+    parser.add_argument('--maxshared', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0)
+    args = parser.parse_args()
+    FakeDB.latency = args.latency
+
+    modes = ['dedicated', 'shared'] if args.mode == 'all' else [args.mode]
+    print("%-10s %8s %16s" % ("mode", "threads", "checkouts/s"))
+    for mode in modes:
+        for threads in args.threads:
+            pool = PooledDB(
+                FakeDB, mincached=args.maxconnections, maxconnections=args.maxconnections,
+                maxshared=args.maxshared if mode == 'shared' else 0, blocking=True,
+            )
+            rate = run(pool, threads, args.seconds, mode == 'shared')
+            pool.close()
+            print("%-10s %8d %16.0f" % (mode, threads, rate))
+
+
+if __name__ == '__main__':
+    main()
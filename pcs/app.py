@@ -7,8 +7,9 @@ from pcs.utils.config_parse import parse_config
 from pcs.common.base import BaseFlaskApp
 
 
-def create_app():
-    args = sys.argv[1:]
+def create_app(args=None):
+    if args is None:
+        args = sys.argv[1:]
     config = parse_config(args)
 
     app = BaseFlaskApp(__name__, template_folder='templates')
@@ -0,0 +1,192 @@
+from pcs.common.enum.system_enum import BufferOverflowPolicy
+from psycopg2.extras import RealDictCursor
+import threading
+import atexit
+import queue
+import time
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 关闭时通知后台线程退出
+_STOP = object()
+
+
+class AuditBuffer:
+    """
+    审计记录的后写缓冲, 请求线程只把记录放入有界队列, 后台线程按数量或时间批量 batch_create
+
+    app: 已初始化的 BaseFlaskApp, 写入时从连接池取自动提交连接
+    table_name: Table类名
+    batch_size: 攒够多少条写入一次
+    flush_interval: 第一条记录入队后最多等待的秒数
+    max_size: 队列容量, 队列满时按 overflow 处理
+    overflow: BufferOverflowPolicy 的值
+    block_timeout: overflow 为 Block 时最多等待的秒数
+    """
+
+    def __init__(self, app, table_name, batch_size=500, flush_interval=1.0, max_size=10000,
+                 overflow=BufferOverflowPolicy.BLOCK.value, block_timeout=0.05):
+        self.app = app
+        self.table_name = table_name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.flushes = 0
+
+        self.__queue = queue.Queue(maxsize=max_size)
+        self.__lock = threading.Lock()
+        self.__stats_lock = threading.Lock()
+        self.__thread = None
+        self.__pid = None
+        self.__closed = False
+        atexit.register(self.close)
+
+    @property
+    def pending(self):
+        return self.__queue.qsize()
+
+    def add(self, record):
+        """放入一条记录, 返回是否已接收(放入队列或同步写入)"""
+        if self.__closed:
+            return self._write([record]) > 0
+
+        self.__ensure_thread()
+        try:
+            if self.overflow == BufferOverflowPolicy.BLOCK.value:
+                self.__queue.put(record, timeout=self.block_timeout)
+            else:
+                self.__queue.put_nowait(record)
+        except queue.Full:
+            if self.overflow == BufferOverflowPolicy.SYNC.value:
+                return self._write([record]) > 0
+
+            with self.__stats_lock:
+                self.dropped += 1
+            logger.warning("审计缓冲[%s]已满, 丢弃记录, 累计丢弃%d条" % (self.table_name, self.dropped))
+            return False
+
+        with self.__stats_lock:
+            self.enqueued += 1
+        return True
+
+    def __ensure_thread(self):
+        # fork 出的子进程中没有父进程的后台线程, 线程意外退出时也需要重新启动
+        if self.__thread is not None and self.__pid == os.getpid() and self.__thread.is_alive():
+            return
+
+        with self.__lock:
+            if self.__thread is None or self.__pid != os.getpid() or not self.__thread.is_alive():
+                self.__pid = os.getpid()
+                self.__thread = threading.Thread(target=self.__run, name="audit-buffer-%s" % self.table_name,
+                                                 daemon=True)
+                self.__thread.start()
+
+    def __run(self):
+        while True:
+            record = self.__queue.get()
+            if record is _STOP:
+                return
+
+            batch = [record]
+            deadline = time.monotonic() + self.flush_interval
+            stop = False
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    record = self.__queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if record is _STOP:
+                    stop = True
+                    break
+                batch.append(record)
+
+            self._write(batch)
+            if stop:
+                return
+
+    def flush(self):
+        """在调用线程写入队列中所有的记录"""
+        batch = []
+        while True:
+            try:
+                record = self.__queue.get_nowait()
+            except queue.Empty:
+                break
+            if record is _STOP:
+                continue
+
+            batch.append(record)
+            if len(batch) >= self.batch_size:
+                self._write(batch)
+                batch = []
+
+        if batch:
+            self._write(batch)
+
+    def close(self, timeout=5):
+        """停止后台线程并写入剩余的记录, 进程退出时自动调用"""
+        if self.__closed:
+            return
+
+        self.__closed = True
+        thread = self.__thread
+        if thread is not None and thread.is_alive() and self.__pid == os.getpid():
+            try:
+                self.__queue.put(_STOP, timeout=timeout)
+            except queue.Full:
+                pass
+            thread.join(timeout)
+        self.flush()
+
+    def _write(self, records):
+        """按字段分组后 batch_create, 失败时重试一次, 返回写入的条数"""
+        groups = {}
+        for record in records:
+            groups.setdefault(tuple(record.keys()), []).append(record)
+
+        written = 0
+        failed = 0
+        for group in groups.values():
+            for attempt in range(2):
+                try:
+                    self.__batch_create(group)
+                    written += len(group)
+                    break
+                except Exception as e:
+                    # 取连接超时或数据库不可用时也只记为失败, 不能让后台线程退出
+                    if attempt:
+                        failed += len(group)
+                        logger.error("审计缓冲[%s]写入%d条失败: %s" % (self.table_name, len(group), str(e)))
+
+        with self.__stats_lock:
+            self.written += written
+            self.failed += failed
+            self.flushes += 1
+        return written
+
+    def __batch_create(self, records):
+        conn = self.app.get_db_connect(self.app.tables.tables[self.table_name].db_name, autocommit=True)
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        try:
+            table_obj = self.app.get_table_obj(self.table_name, cur)
+            table_obj.batch_create(records, page_size=self.batch_size)
+        finally:
+            cur.close()
+            conn.close()
+
+    def stats(self):
+        return {
+            "table": self.table_name, "pending": self.pending, "enqueued": self.enqueued, "written": self.written,
+            "dropped": self.dropped, "failed": self.failed, "flushes": self.flushes,
+        }
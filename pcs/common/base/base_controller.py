@@ -22,23 +22,27 @@ class BaseController:
         return table_obj
 
     def get_table_objs(self, *table_names):
-        table_objs = tuple(current_app.get_table_obj(name, self.conn) for name in table_names)
+        table_objs = tuple(current_app.get_table_obj(name, self.cur) for name in table_names)
         return table_objs
 
     def get_table_obj_dict(self, table_names):
         table_obj_dict = {}
         for name in table_names:
-            table_obj_dict[name] = current_app.get_table_obj(name, self.conn)
+            table_obj_dict[name] = current_app.get_table_obj(name, self.cur)
         return table_obj_dict
 
-    def __del__(self):
-        """Delete the steady connection."""
+    def close(self):
+        """关闭游标并将连接归还连接池."""
         try:
             self.cur.close()  # 确保连接已关闭
             self.conn.close()   # 确保连接已关闭
         except Exception:  # 内置异常可能不再存在
             pass
 
+    def __del__(self):
+        """Delete the steady connection."""
+        self.close()
+
     def close_autocommit(self):
         self.conn.set_conn(autocommit=False)
 
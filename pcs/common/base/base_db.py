@@ -33,3 +33,7 @@ class DBPool(dict):
     def exists_pool(self, pool_name):
         return True if pool_name in self.keys() else False
 
+
+    def stats(self):
+        """各连接池的使用情况, {数据库名: PooledDB.stats()}"""
+        return {name: pool.stats() for name, pool in self.items()}
@@ -11,6 +11,7 @@ class BaseFlaskApp(Flask):
 
     def __init__(self, *args, **kwargs):
         self.__tables = Tables()
+        self.__tables.connection_factory = lambda db_name: self.get_db_connect(db_name, autocommit=True)
         self.__db_pool = DBPool()
         self.dbs_conf = {}
         super(BaseFlaskApp, self).__init__(*args, **kwargs)
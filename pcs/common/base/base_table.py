@@ -1,9 +1,24 @@
-from pcs.common.enum.system_enum import DBResultState, DBType, DBExecMode
+from pcs.common.enum.system_enum import DBResultState, DBType, DBExecMode, PaginateMode, RowFormat, PartitionInterval
 from psycopg2.errors import Error as PgError
 from psycopg2 import extensions
 from psycopg2 import extras
 from pcs.common.sql_operator import *
-from pcs.common.errors import DBCreateError, DBQueryError, DBDeleteError, DBUpdateError
+from pcs.common.errors import DBCreateError, DBQueryError, DBDeleteError, DBUpdateError, InvalidScError
+from pcs.common.page_cursor import encode_cursor, decode_cursor
+from pcs.common.sql_condition import Sc
+from pcs.common.partition import PARTITION_RELKIND_SQL, PARTITION_LIST_SQL, PARTITIONED_RELKIND, partition_start, \
+    next_partition_start, partition_name, parse_range_bound
+from pcs.common.id_allocator import id_allocator, DEFAULT_ID_BLOCK_SIZE
+from pcs.common.copy_stream import CopyRowStream, COPY_FORMAT_TEXT
+from pcs.common.json_adapter import adapt_json, JSON_COLUMN_TYPES
+from pcs.common.row_format import convert_rows
+from pcs.common.columnar import ColumnarBuilder
+from collections import OrderedDict
+import threading
+import weakref
+import time
+import uuid
+import os
 import logging
 import datetime
 import json
@@ -11,14 +26,163 @@ import json
 logger = logging.getLogger(__name__)
 
 
+SCHEMA_TABLE_FILTER_SQL = """
+      from pg_class c
+      join pg_namespace n on n.oid = c.relnamespace
+      join pg_attribute a on a.attrelid = c.oid and a.attnum > 0 and not a.attisdropped
+      join pg_type t on t.oid = a.atttypid
+ left join pg_index i on i.indrelid = c.oid and i.indisprimary
+     where c.relname in %s
+       and c.relkind in ('r', 'p', 'v', 'm', 'f')
+       and n.nspname = any(current_schemas(false))
+"""
+
+SCHEMA_COLUMNS_SQL = """
+    select c.relname table_name,
+           a.attname column_name,
+           a.attnum ordinal_position,
+           format_type(a.atttypid, a.atttypmod) data_type,
+           t.typname udt_name,
+           not a.attnotnull is_nullable,
+           coalesce(a.attnum = any(i.indkey), false) is_primary_key
+""" + SCHEMA_TABLE_FILTER_SQL + """
+     order by c.relname, a.attnum
+"""
+
+SCHEMA_VERSION_SQL = """
+    select md5(string_agg(
+               c.oid::text || ':' || a.attnum || ':' || a.attname || ':' || a.atttypid::text || ':'
+               || a.atttypmod || ':' || a.attnotnull::text || ':' || coalesce(i.indkey::text, ''),
+               ',' order by c.oid, a.attnum
+           )) schema_version
+""" + SCHEMA_TABLE_FILTER_SQL
+
+
+class ColumnInfo:
+    def __init__(self, name, data_type, udt_name, nullable=True, is_primary_key=False, position=None):
+        self.name = name
+        self.data_type = data_type
+        self.udt_name = udt_name
+        self.nullable = nullable
+        self.is_primary_key = is_primary_key
+        self.position = position
+
+    def __repr__(self):
+        return "ColumnInfo(%s %s)" % (self.name, self.data_type)
+
+
 class TableInfo:
-    def __init__(self, table):
+    def __init__(self, table, columns=None):
         self.__table = table
+        self.__columns = OrderedDict((column.name, column) for column in (columns or []))
+
+    @property
+    def table(self):
+        return self.__table
+
+    @property
+    def columns(self):
+        return self.__columns
+
+    @property
+    def column_names(self):
+        return tuple(self.__columns.keys())
+
+    @property
+    def primary_keys(self):
+        return tuple(name for name, column in self.__columns.items() if column.is_primary_key)
+
+    def has_column(self, name):
+        return name in self.__columns
+
+    def get_column(self, name):
+        return self.__columns.get(name)
+
+
+class SqlCache:
+    """已编译SQL语句的LRU缓存, 以条件形态为键, 命中后只需绑定参数"""
+
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.__statements = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, key):
+        with self.__lock:
+            statement = self.__statements.get(key)
+            if statement is None:
+                self.misses += 1
+                return None
+
+            self.__statements.move_to_end(key)
+            self.hits += 1
+            return statement
+
+    def set(self, key, statement):
+        if not self.max_size:
+            return None
+
+        with self.__lock:
+            self.__statements[key] = statement
+            self.__statements.move_to_end(key)
+            while len(self.__statements) > self.max_size:
+                self.__statements.popitem(last=False)
+
+    def clear(self):
+        with self.__lock:
+            self.__statements.clear()
+
+    def __len__(self):
+        return len(self.__statements)
+
+
+class ColumnRegistry:
+    """Table的字段类型, 来源于类上声明的 columns 或由 Tables 加载的 table_info"""
+
+    def __init__(self, source, column_types=None, deferred_columns=()):
+        self.source = source
+        self.column_types = column_types
+        self.json_columns = frozenset()
+        self.default_fields = None
+        if column_types is not None:
+            self.json_columns = frozenset(
+                name for name, column_type in column_types.items() if column_type in JSON_COLUMN_TYPES
+            )
+            if deferred_columns:
+                self.default_fields = tuple(name for name in column_types if name not in deferred_columns)
+
+    @property
+    def known(self):
+        return self.column_types is not None
+
+    def unknown_fields(self, fields):
+        if self.column_types is None:
+            return []
+        return [f for f in fields if f not in self.column_types]
+
+    def get_type(self, field):
+        if self.column_types is None:
+            return None
+        return self.column_types.get(field)
 
 
 class Tables:
     def __init__(self):
         self.__tables = {}
+        # 每个数据库最近一次加载的表结构版本, 以及最近一次检查的时间
+        self.__schema_versions = {}
+        self.__schema_checked_at = {}
+        self.__schema_lock = threading.Lock()
+        # 检查表结构是否变化的最小间隔(秒)
+        self.schema_check_interval = 60
+        # connection_factory(db_name) 返回数据库的自动提交连接, 检查表结构时使用, 不占用请求的事务
+        self.connection_factory = None
+        # 定期检查表结构的后台线程, fork 出的子进程中需要重新启动
+        self.__checker = None
+        self.__checker_pid = None
+        self.__checker_lock = threading.Lock()
 
     @property
     def tables(self):
@@ -38,12 +202,138 @@ class Tables:
 
         return False
 
-    def get_table(self, table_name, conn):
+    def get_table(self, table_name, cur):
         if not self.exists_table(table_name):
             raise Exception("不存在此Table %s" % table_name)
 
         table_class = self.__tables.get(table_name)
-        return table_class(conn)
+        self.start_schema_checker()
+        return table_class(cur)
+
+    def start_schema_checker(self):
+        """启动按 schema_check_interval 检查表结构的后台线程, 检查不在请求线程中取连接"""
+        if self.connection_factory is None or not self.schema_check_interval:
+            return None
+        if self.__checker is not None and self.__checker_pid == os.getpid() and self.__checker.is_alive():
+            return None
+
+        with self.__checker_lock:
+            if self.__checker is None or self.__checker_pid != os.getpid() or not self.__checker.is_alive():
+                self.__checker_pid = os.getpid()
+                self.__checker = threading.Thread(
+                    target=_schema_check_loop, args=(weakref.ref(self),), name="tables-schema-check", daemon=True)
+                self.__checker.start()
+        return None
+
+    def db_names(self):
+        return set(table_class.db_name for table_class in self.__tables.values() if table_class.table_name)
+
+    def get_db_tables(self, db_name):
+        return [
+            table_class for table_class in self.__tables.values()
+            if table_class.table_name and table_class.db_name == db_name
+        ]
+
+    def load_tables_info(self, cur, db_name):
+        """一次查询加载数据库中所有已注册表的字段信息, 缓存到各个Table类的 table_info"""
+        table_classes = self.get_db_tables(db_name)
+        if not table_classes:
+            return None
+
+        table_names = tuple(set(table_class.table_name for table_class in table_classes))
+        catalog_cur = cur.connection.cursor(cursor_factory=extras.RealDictCursor)
+        try:
+            catalog_cur.execute(SCHEMA_VERSION_SQL, (table_names,))
+            schema_version = catalog_cur.fetchone()['schema_version']
+            catalog_cur.execute(SCHEMA_COLUMNS_SQL, (table_names,))
+            rows = catalog_cur.fetchall()
+        finally:
+            catalog_cur.close()
+
+        table_columns = {}
+        for row in rows:
+            table_columns.setdefault(row['table_name'], []).append(ColumnInfo(
+                row['column_name'], row['data_type'], row['udt_name'], nullable=row['is_nullable'],
+                is_primary_key=row['is_primary_key'], position=row['ordinal_position'],
+            ))
+
+        for table_class in table_classes:
+            columns = table_columns.get(table_class.table_name)
+            if not columns:
+                logger.warning("未找到表'%s'的字段信息" % table_class.table_name)
+            table_class.table_info = TableInfo(table_class, columns) if columns else None
+            table_class.get_sql_cache().clear()
+
+        self.__schema_versions[db_name] = schema_version
+        self.__schema_checked_at[db_name] = time.monotonic()
+        logger.info("加载数据库[%s]表结构: %s" % (db_name, ",".join(table_names)))
+        return schema_version
+
+    def refresh_tables_info(self, db_name, force=False):
+        """
+        按 schema_check_interval 检查表结构版本, 版本变化时重新加载, 返回是否重新加载;
+        由后台线程在 connection_factory 取得的单独连接上执行, 未设置 connection_factory 时不检查
+        """
+        if self.connection_factory is None:
+            return False
+
+        checked_at = self.__schema_checked_at.get(db_name)
+        if not force and checked_at is not None and time.monotonic() - checked_at < self.schema_check_interval:
+            return False
+
+        if not self.__schema_lock.acquire(blocking=force):
+            # 其他线程正在检查
+            return False
+
+        conn = None
+        try:
+            self.__schema_checked_at[db_name] = time.monotonic()
+            table_names = tuple(set(table_class.table_name for table_class in self.get_db_tables(db_name)))
+            if not table_names:
+                return False
+
+            conn = self.connection_factory(db_name)
+            if not conn:
+                return False
+            cur = conn.cursor(cursor_factory=extras.RealDictCursor)
+            try:
+                cur.execute(SCHEMA_VERSION_SQL, (table_names,))
+                schema_version = cur.fetchone()['schema_version']
+                if not force and schema_version == self.__schema_versions.get(db_name):
+                    return False
+
+                self.load_tables_info(cur, db_name)
+                return True
+            finally:
+                cur.close()
+        except Exception as e:
+            # 取连接超时或查询失败时沿用已加载的表结构, 不影响请求
+            logger.warning("检查数据库[%s]表结构失败: %s" % (db_name, str(e)))
+            return False
+        finally:
+            if conn:
+                conn.close()
+            self.__schema_lock.release()
+
+
+def _schema_check_loop(tables_ref):
+    """只持有 Tables 的弱引用, Tables 被回收后退出"""
+    while True:
+        tables = tables_ref()
+        if tables is None:
+            return
+        interval = tables.schema_check_interval
+        if not interval:
+            return
+        del tables
+        time.sleep(interval)
+
+        tables = tables_ref()
+        if tables is None:
+            return
+        for db_name in tables.db_names():
+            tables.refresh_tables_info(db_name)
+        del tables
 
 
 class BaseTable(object):
@@ -52,6 +342,28 @@ class BaseTable(object):
     table_name = None
     default_value = {}
     primary_keys = ("id",)
+    # 由 Tables.load_tables_info 加载的字段信息 TableInfo
+    table_info = None
+    # 声明字段类型 {字段: 类型}, 类型可以是 SQL_TYPE_MAP 的键或数据库类型, 未声明时使用 table_info
+    columns = None
+    # 不指定 fields 查询时不返回的字段, 如密码, 大JSON
+    deferred_columns = ()
+    # 每个Table类缓存的已编译查询语句数量, 0 表示不缓存
+    sql_cache_size = 256
+    # 批量写入时每次从序列预留的主键数量
+    id_block_size = DEFAULT_ID_BLOCK_SIZE
+    # 保留期限, retention_field 早于 retention_days 天前的行由 purge_expired 清理, 未设置时不清理
+    retention_field = None
+    retention_days = None
+    # 为 True 时由 Initializer 创建 AuditBuffer, create_deferred 的记录在后台批量写入
+    write_behind = False
+    write_buffer = None
+    # 按时间范围分区的字段, 表需要已经按该字段 partition by range 创建, 分区由 ensure_partitions 创建
+    partition_field = None
+    # 每个分区的时间范围, PartitionInterval 的值
+    partition_interval = PartitionInterval.MONTH.value
+    # 除当前分区外提前创建的分区数量
+    partition_premake = 2
 
     def __init__(self, cur, user_id=None):
         self.cur = cur
@@ -104,11 +416,55 @@ class BaseTable(object):
     def error_msg(self):
         return self.exec_state.error_msg
 
+    @classmethod
+    def get_sql_cache(cls):
+        sql_cache = cls.__dict__.get('_sql_cache')
+        if sql_cache is None:
+            sql_cache = SqlCache(cls.sql_cache_size)
+            cls._sql_cache = sql_cache
+
+        return sql_cache
+
+    @classmethod
+    def get_column_registry(cls):
+        source = cls.columns or cls.table_info
+        registry = cls.__dict__.get('_column_registry')
+        if registry is None or registry.source is not source:
+            if cls.columns:
+                column_types = OrderedDict(
+                    (name, SQL_TYPE_MAP.get(column_type, column_type).lower()) for name, column_type in cls.columns.items()
+                )
+            elif cls.table_info:
+                column_types = OrderedDict(
+                    (name, column.data_type) for name, column in cls.table_info.columns.items()
+                )
+            else:
+                column_types = None
+
+            registry = ColumnRegistry(source, column_types, cls.deferred_columns)
+            cls._column_registry = registry
+
+        return registry
+
+    def _check_fields(self, fields, error_class=InvalidScError):
+        """表结构已知时, 拒绝不存在的字段"""
+        unknown_fields = self.get_column_registry().unknown_fields(fields)
+        if unknown_fields:
+            error_info = "表'{0}'不存在字段: {1}".format(self.table_name, ",".join(unknown_fields))
+            self.exec_state.failure(error_info)
+            raise error_class(error_info)
+
     def get_table_name_sql(self):
         return '{0}{1}{0}'.format(self.field_symbol, self.table_name)
 
+    def get_sequence_name(self):
+        return '%s_id_seq' % self.table_name
+
     def get_table_field_sql(self, field):
-        return '{0}{1}{0}'.format(self.field_symbol, field)
+        symbol = self.field_symbol
+        if symbol:
+            field = field.replace(symbol, symbol * 2)
+        return '{0}{1}{0}'.format(symbol, field)
 
     def get_tables_info(self, table_names):
         select_sql = """
@@ -136,7 +492,12 @@ class BaseTable(object):
     def get_self_table_info(self):
         return self.get_tables_info([self.table_name])
 
-    def query(self, sc, fields=None, offset=None, limit=None, order_by=None, count=None, distinct=None):
+    def query(self, sc, fields=None, offset=None, limit=None, order_by=None, count=None, distinct=None,
+              row_format=RowFormat.DICT.value):
+        """
+        :param row_format: 返回的行格式, 见 RowFormat, 默认字典;
+            TUPLE 返回 TupleRows(元组行, 共享列索引), SLOTS 返回 __slots__ 行对象, 均比字典节省内存
+        """
         sql_str, params = self._generate_query_sql(sc, fields=fields, offset=offset, limit=limit,
                                                    order_by=order_by, count=count, distinct=distinct)
         if not sql_str:
@@ -148,13 +509,28 @@ class BaseTable(object):
             self.exec_state.failure(error_info)
             raise DBQueryError(error_info)
 
-        return self._query(sql_str, params=params)
+        return self._query(sql_str, params=params, row_format=row_format)
+
+    def _query(self, sql_str, params=None, row_format=RowFormat.DICT.value):
+        if row_format == RowFormat.DICT.value:
+            return self.__execute(sql_str, params=params)
+
+        cursor = self._new_cursor()
+        try:
+            rows = self.__execute(sql_str, params=params, cursor=cursor)
+            columns = [column.name for column in cursor.description]
+        finally:
+            cursor.close()
 
-    def _query(self, sql_str, params=None):
-        rows = self.__execute(sql_str, params=params)
-        return rows
+        return convert_rows(columns, rows, row_format)
 
-    def paginate_query(self, sc, page_index=1, page_size=20, fields=None, order_by=None):
+    def iter_query(self, sc, fields=None, order_by=None, chunk_size=2000, row_format=RowFormat.DICT.value):
+        """
+        使用服务端命名游标分批读取, 逐行返回结果, 内存占用与结果集大小无关
+        连接处于自动提交模式时使用 WITH HOLD 游标, 在事务中使用效率更高
+        :param chunk_size: 每次从服务端读取的行数
+        :param row_format: 行格式, 见 query
+        """
         sql_str, params = self._generate_query_sql(sc, fields=fields, order_by=order_by)
         if not sql_str:
             error_info = """生成SQL失败:{}""".format(str(sc))
@@ -165,35 +541,334 @@ class BaseTable(object):
             self.exec_state.failure(error_info)
             raise DBQueryError(error_info)
 
-        return self._paginate_query(sql_str, params=params, page_index=page_index, page_size=page_size)
+        return self._iter_query(sql_str, params=params, chunk_size=chunk_size, row_format=row_format)
 
-    def _paginate_query(self, sql_str, params=None, page_index=1, page_size=20):
-        query_row_count_sql = """select count(1) row_count 
-              from ({0}) t
-             where 1=1
-        """.format(sql_str)
+    def _iter_query(self, sql_str, params=None, chunk_size=2000, row_format=RowFormat.DICT.value):
+        cursor_factory = extras.RealDictCursor if row_format == RowFormat.DICT.value else None
+        cursor = self._new_cursor(name="pcs_iter_%s" % uuid.uuid4().hex, cursor_factory=cursor_factory)
+        cursor.itersize = chunk_size
+        try:
+            while True:
+                rows = self.__fetch_chunk(cursor, sql_str, params, chunk_size)
+                if not rows:
+                    break
+
+                if cursor_factory is None:
+                    rows = convert_rows([column.name for column in cursor.description], rows, row_format)
+                yield from rows
+                sql_str = None
+        finally:
+            try:
+                cursor.close()
+            except PgError:
+                # 游标声明失败时服务端不存在该游标
+                pass
+
+    def query_columns(self, sc, fields=None, order_by=None, chunk_size=10000):
+        """
+        列式查询, 返回 {列名: numpy数组}, 按 chunk_size 从服务端命名游标分批读取并转换, 不生成行对象
+        需要安装 numpy, 各类型的转换规则见 ColumnarBuilder
+        """
+        sql_str, params = self._generate_query_sql(sc, fields=fields, order_by=order_by)
+        if not sql_str:
+            error_info = """生成SQL失败:{}""".format(str(sc))
+            if len(error_info) > 1048576:
+                # 如果错误信息大小超过1M, 就截取前后两512K的内容存取,防止意外的存储爆炸
+                error_info = error_info[:524288] + error_info[-524288:]
 
-        rows = self.__execute(query_row_count_sql, params=params)
-        row_count = 0
+            self.exec_state.failure(error_info)
+            raise DBQueryError(error_info)
+
+        cursor = self._new_cursor(name="pcs_columns_%s" % uuid.uuid4().hex)
+        builder = None
+        try:
+            while True:
+                rows = self.__fetch_chunk(cursor, sql_str, params, chunk_size)
+                if builder is None:
+                    builder = ColumnarBuilder(cursor.description)
+                if not rows:
+                    break
+
+                builder.append(rows)
+                sql_str = None
+        finally:
+            try:
+                cursor.close()
+            except PgError:
+                pass
+
+        return builder.build()
+
+    def __fetch_chunk(self, cursor, sql_str, params, chunk_size):
+        """sql_str 不为空时先执行查询, 然后从命名游标读取下一批数据"""
+        try:
+            if sql_str:
+                cursor.execute(sql_str, params)
+            return cursor.fetchmany(chunk_size)
+        except PgError as e:
+            exception_info = "{0}.{1}: {2}".format(e.__module__, type(e).__name__, e.pgerror)
+            error_info = """DB执行SQL失败
+-----sql----------\n{0}
+-----end sql------\n{1}
+            """.format(sql_str or cursor.query, exception_info).strip()
+            self.exec_state.failure(error_info)
+            raise DBQueryError(error_info)
+
+    def _new_cursor(self, name=None, cursor_factory=None):
+        """在当前游标所属的连接上创建新游标, 指定 name 时为服务端命名游标"""
+        connection = self.cur.connection
+        withhold = bool(name) and connection.autocommit
+        return connection.cursor(name=name, cursor_factory=cursor_factory, withhold=withhold)
+
+    def aggregate_query(self, sc, aggregates, group_by=None, having=None, order_by=None, limit=None,
+                        row_format=RowFormat.DICT.value):
+        """
+        在数据库中分组聚合, 只返回聚合后的结果
+        :param aggregates: [(函数, 字段, 别名)], 函数: count, sum, min, max, avg, count_distinct, count 的字段可以是 '*'
+        :param group_by: 分组字段列表, 元素为字段名, 或 (时间字段, 截断单位) 如 ("login_time", "day"), 结果列名为字段名
+        :param having: 聚合结果的条件 [(别名, 操作符, 值)], 操作符: =, !=, >, >=, <, <=
+        :param order_by: 排序的分组字段或聚合别名列表, 以 '-' 开头表示倒序
+        :param limit: 返回的分组数量
+        """
+        success, permissions_condition = self._get_permissions_condition()
+        if not success:
+            error_info = "没有查询权限"
+            self.exec_state.failure(error_info)
+            raise DBQueryError(error_info)
+
+        sc.add_conditions(permissions_condition)
+        conditions = self.__normalize_conditions(sc)
+        having = having or []
+        limit = limit if isinstance(limit, int) else None
+
+        statement_key = (
+            'aggregate', self.__condition_shape(conditions),
+            tuple(tuple(g) if isinstance(g, (list, tuple)) else g for g in (group_by or [])),
+            tuple(tuple(a) for a in aggregates),
+            tuple((h[0], h[1]) for h in having),
+            tuple(order_by or []), limit is not None,
+        )
+        sql_cache = self.get_sql_cache()
+        select_sql = sql_cache.get(statement_key)
+        if select_sql is None:
+            select_sql = self.__compile_aggregate_sql(statement_key)
+            sql_cache.set(statement_key, select_sql)
+
+        params = self.__bind_condition_params(conditions)
+        params.extend(h[2] for h in having)
+        if limit is not None:
+            params.append(limit)
+
+        return self._query(select_sql, params=tuple(params) if params else None, row_format=row_format)
+
+    def __compile_aggregate_sql(self, statement_key):
+        _, condition_shape, group_by, aggregates, having, order_by, has_limit = statement_key
+        if not aggregates:
+            error_info = "未设置聚合函数"
+            self.exec_state.failure(error_info)
+            raise InvalidScError(error_info)
+
+        self._check_fields([f for condition_fields, operate in condition_shape if operate != SQL_OR
+                            for f in condition_fields])
+
+        select_sql_list = []
+        output_names = []
+        for item in group_by:
+            if isinstance(item, tuple):
+                field, unit = item
+                if unit not in SQL_DATE_TRUNC_UNITS:
+                    raise InvalidScError("不支持的时间截断单位'{0}'".format(unit))
+                expression = "date_trunc('{0}', {1})".format(unit, self.get_table_field_sql(field))
+            else:
+                field = item
+                expression = self.get_table_field_sql(field)
+
+            self._check_fields([field])
+            select_sql_list.append("{0} {1}".format(expression, self.get_table_field_sql(field)))
+            output_names.append(field)
+
+        aggregate_expressions = {}
+        for func, field, alias in aggregates:
+            if func not in SQL_AGGREGATE_FUNCS:
+                raise InvalidScError("不支持的聚合函数'{0}'".format(func))
+            if field == '*':
+                if func != 'count':
+                    raise InvalidScError("聚合函数'{0}'不支持'*'".format(func))
+                field_sql = '*'
+            else:
+                self._check_fields([field])
+                field_sql = self.get_table_field_sql(field)
+
+            expression = SQL_AGGREGATE_FUNCS[func].format(field_sql)
+            aggregate_expressions[alias] = expression
+            select_sql_list.append("{0} {1}".format(expression, self.get_table_field_sql(alias)))
+            output_names.append(alias)
+
+        having_sql_list = []
+        for alias, operate in having:
+            if alias not in aggregate_expressions:
+                raise InvalidScError("HAVING 条件'{0}'不是聚合别名".format(alias))
+            if operate not in SQL_HAVING_OPERATE_VALUES:
+                raise InvalidScError("不支持的操作符'{0}'".format(operate))
+            having_sql_list.append("{0} {1} %s".format(aggregate_expressions[alias], operate))
+
+        order_sql_list = []
+        for name in order_by:
+            descending = name.startswith('-')
+            name = name.lstrip('-')
+            if name not in output_names:
+                raise InvalidScError("排序字段'{0}'不在结果中".format(name))
+            order_sql_list.append(self.get_table_field_sql(name) + (" desc" if descending else ""))
+
+        select_sql = """select {select_sql}
+              from {table_name}
+             where 1 = 1
+             {condition_sql}
+        """.format(
+            select_sql=", ".join(select_sql_list),
+            table_name=self.get_table_name_sql(),
+            condition_sql=self.__compile_condition_sql(condition_shape),
+        )
 
-        if row_count <= (page_index - 1) * page_size:
+        if group_by:
+            select_sql += " Group By {0}".format(", ".join(str(i + 1) for i in range(len(group_by))))
+
+        if having_sql_list:
+            select_sql += " Having {0}".format(" And ".join(having_sql_list))
+
+        if order_sql_list:
+            select_sql += " Order By {0}".format(", ".join(order_sql_list))
+
+        if has_limit:
+            select_sql += " Limit %s"
+
+        return select_sql
+
+    def paginate_query(self, sc, page_index=1, page_size=20, fields=None, order_by=None,
+                       count_mode=PaginateMode.EXACT.value):
+        """
+        :param count_mode: 总行数的统计方式, 见 PaginateMode
+            EXACT: 窗口函数统计总数, 查询页数据与总数只执行一次
+            HAS_MORE: 不统计总数, 返回的行数为已知的最少行数, 大于 page_index * page_size 时表示存在下一页
+            ESTIMATE: 使用执行计划的估算行数, 适用于超大表
+            页码超出范围时各模式都返回空页, 总行数为 0, 不额外查询
+        :return: (总行数, 当前页数据)
+        """
+        sql_str, params = self._generate_query_sql(sc, fields=fields, order_by=order_by)
+        if not sql_str:
+            error_info = """生成SQL失败:{}""".format(str(sc))
+            if len(error_info) > 1048576:
+                # 如果错误信息大小超过1M, 就截取前后两512K的内容存取,防止意外的存储爆炸
+                error_info = error_info[:524288] + error_info[-524288:]
+
+            self.exec_state.failure(error_info)
+            raise DBQueryError(error_info)
+
+        return self._paginate_query(sql_str, params=params, page_index=page_index, page_size=page_size,
+                                    count_mode=count_mode)
+
+    def _paginate_query(self, sql_str, params=None, page_index=1, page_size=20, count_mode=PaginateMode.EXACT.value):
+        if page_index < 1:
             page_index = 1
 
         offset = (page_index - 1) * page_size
-        limit = page_size
-        query_sql = """select * 
+        if count_mode == PaginateMode.HAS_MORE.value:
+            rows = self.__execute_page_sql(sql_str, params, page_size + 1, offset)
+            if not rows:
+                return 0, rows
+
+            has_more = len(rows) > page_size
+            rows = rows[:page_size]
+            return offset + len(rows) + (1 if has_more else 0), rows
+
+        if count_mode == PaginateMode.ESTIMATE.value:
+            rows = self.__execute_page_sql(sql_str, params, page_size, offset)
+            if not rows:
+                return 0, rows
+            if len(rows) < page_size:
+                # 最后一页, 总数是确定的
+                return offset + len(rows), rows
+
+            row_count = self.estimate_row_count(sql_str, params=params)
+            return max(row_count, offset + len(rows)), rows
+
+        page_sql = """select t.*, count(1) over() {row_count_field}
               from (
                     {sql_str}
-                   ) t 
-             limit {limit}
-            offset {offset}
+                   ) t
         """.format(
             sql_str=sql_str,
-            limit=limit,
-            offset=offset,
+            row_count_field=PAGE_ROW_COUNT_FIELD,
         )
+        rows = self.__execute_page_sql(page_sql, params, page_size, offset)
+        if not rows:
+            return 0, rows
+
+        # 总数是最后一列, 字典行按字段名删除, 元组行按位置去掉
+        if isinstance(rows[0], dict):
+            row_count = rows[0][PAGE_ROW_COUNT_FIELD]
+            for row in rows:
+                del row[PAGE_ROW_COUNT_FIELD]
+            return row_count, rows
+
+        return rows[0][-1], [tuple(row[:-1]) for row in rows]
+
+    def __execute_page_sql(self, sql_str, params, limit, offset):
+        page_sql = """select *
+              from (
+                    {sql_str}
+                   ) t
+             limit %s
+            offset %s
+        """.format(sql_str=sql_str)
+
+        return self.__execute(page_sql, params=tuple(params or ()) + (limit, offset))
+
+    def estimate_row_count(self, sql_str, params=None):
+        """根据执行计划估算查询的行数, 不实际执行查询"""
+        rows = self.__execute("explain (format json) " + sql_str, params=params)
+        if not rows:
+            return 0
+
+        plan = next(iter(rows[0].values())) if isinstance(rows[0], dict) else rows[0][0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+
+        return int(plan[0]["Plan"]["Plan Rows"])
 
-        return row_count, self.__execute(query_sql, params=params)
+    def keyset_paginate_query(self, sc, cursor=None, page_size=20, fields=None, sort_keys=None, descending=False):
+        """
+        键集(seek)分页, 通过上一页最后一行的排序键定位, 深分页不需要扫描并丢弃之前的行
+        :param cursor: 上一页返回的游标, 为空时查询第一页
+        :param sort_keys: 排序键, 必须能唯一确定一行, 默认使用 primary_keys
+        :param descending: 是否倒序
+        :return: (下一页游标, 当前页数据), 没有下一页时游标为 None
+        """
+        sort_keys = tuple(sort_keys or self.primary_keys)
+        seek_values = decode_cursor(cursor, len(sort_keys)) if cursor else None
+        if fields:
+            fields = list(fields) + [k for k in sort_keys if k not in fields]
+
+        # 多取一行用于判断是否存在下一页
+        sql_str, params = self._generate_query_sql(sc, fields=fields, limit=page_size + 1, seek_keys=sort_keys,
+                                                   seek_values=seek_values, seek_desc=descending)
+        if not sql_str:
+            error_info = """生成SQL失败:{}""".format(str(sc))
+            if len(error_info) > 1048576:
+                # 如果错误信息大小超过1M, 就截取前后两512K的内容存取,防止意外的存储爆炸
+                error_info = error_info[:524288] + error_info[-524288:]
+
+            self.exec_state.failure(error_info)
+            raise DBQueryError(error_info)
+
+        rows = self._query(sql_str, params=params)
+        next_cursor = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            last_row = rows[-1]
+            next_cursor = encode_cursor([last_row[k] for k in sort_keys])
+
+        return next_cursor, rows
 
     def create(self, insert_data, return_fields=None):
         if not insert_data:
@@ -220,13 +895,33 @@ class BaseTable(object):
         self.__log_field = old_log_field
         return result
 
+    def create_deferred(self, insert_data):
+        """
+        补充审计字段后交给 write_buffer 在后台批量写入, 不返回主键; 未配置缓冲时同步 create
+        :return: 是否已接收
+        """
+        if self.write_buffer is None:
+            return bool(self.create(insert_data))
+
+        self.__remove_extra_field(insert_data)
+        self.__add_extra_value(insert_data)
+        return self.write_buffer.add(insert_data)
+
     def _create(self, sql_str, params=None):
         return self.__execute(sql_str, params=params, mode=DBExecMode.INSERT.name)
 
-    def batch_create(self, insert_data_list=None, page_size=1000, fetch=False, return_fields=None):
+    def batch_create(self, insert_data_list=None, page_size=1000, fetch=False, return_fields=None, use_copy=False,
+                     return_ids=False):
+        """
+        :param use_copy: 使用 COPY FROM STDIN 写入, insert_data_list 可以是任意可迭代对象
+        :param return_ids: 返回写入行的主键列表, 主键在写入前分配或由数据提供, 不需要 fetch
+        """
         if not insert_data_list:
             return True
 
+        if use_copy:
+            return self.copy_create(insert_data_list, chunk_size=page_size, return_ids=fetch or return_ids)
+
         data_keys = insert_data_list[0].keys()
         if not data_keys:
             error_info = "创建的数据字段为空"
@@ -238,11 +933,13 @@ class BaseTable(object):
                 error_info = """创建的字段不一致:
 第一行: {0}
 异常行: {1}
-                """.format(",".join(data_keys), ",".join(data_keys.keys()))
+                """.format(",".join(data_keys), ",".join(insert_data.keys()))
                 self.exec_state.failure(error_info)
                 raise DBCreateError(error_info)
 
-        insert_sql, params, template = self._generate_batch_insert_sql(insert_data_list)
+        insert_sql, params, template = self._generate_batch_insert_sql(
+            insert_data_list, return_fields=(return_fields or self.primary_keys) if fetch else None
+        )
         if not insert_sql:
             error_info = """生成SQL失败:{}""".format(str(insert_data_list[0]))
             if len(error_info) > 1048576:
@@ -252,7 +949,11 @@ class BaseTable(object):
             self.exec_state.failure(error_info)
             raise DBCreateError(error_info)
 
-        return self._batch_create(insert_sql, params=params, template=template, page_size=page_size, fetch=fetch)
+        result = self._batch_create(insert_sql, params=params, template=template, page_size=page_size, fetch=fetch)
+        if return_ids:
+            return [insert_data['id'] for insert_data in insert_data_list] if 'id' in insert_data_list[0] else []
+
+        return result
 
     def _batch_create(self, insert_sql, params=None, template=None, page_size=1000, fetch=True):
         result = self.__execute(insert_sql, params=params, template=template, page_size=page_size, fetch=fetch,
@@ -262,6 +963,170 @@ class BaseTable(object):
 
         return result
 
+    def copy_create(self, insert_rows, chunk_size=10000, return_ids=False, copy_format=COPY_FORMAT_TEXT):
+        """
+        使用 COPY FROM STDIN 批量写入, 按 chunk_size 从可迭代对象中分块读取, 不需要一次性生成全部数据
+        :param insert_rows: 可迭代的行, 每行是字典, 字段需要一致
+        :param copy_format: COPY 的格式, text 或 csv
+        :return: return_ids 为 True 时返回生成的主键列表, 否则返回写入的行数
+        """
+        use_sequence = self.db_type == DBType.Postgresql.value and self.primary_keys[0] == 'id'
+        if return_ids and not use_sequence:
+            error_info = "表{0}的主键不是序列生成的id, 无法返回COPY写入的主键".format(self.table_name)
+            self.exec_state.failure(error_info)
+            raise DBCreateError(error_info)
+
+        insert_keys = None
+        row_count = 0
+        ids = []
+        for chunk in self.__iter_chunks(insert_rows, chunk_size):
+            for insert_data in chunk:
+                self.__remove_extra_field(insert_data)
+                self.__add_extra_value(insert_data)
+
+                if insert_keys is None:
+                    insert_keys = list(insert_data.keys())
+                    if not insert_keys:
+                        error_info = "创建的数据字段为空"
+                        self.exec_state.failure(error_info)
+                        raise DBCreateError(error_info)
+                elif len(insert_keys) != len(insert_data) or any(k not in insert_data for k in insert_keys):
+                    error_info = """创建的字段不一致:
+第一行: {0}
+异常行: {1}
+                    """.format(",".join(insert_keys), ",".join(insert_data.keys()))
+                    self.exec_state.failure(error_info)
+                    raise DBCreateError(error_info)
+
+            copy_keys = insert_keys
+            if use_sequence and 'id' not in insert_keys:
+                copy_keys = insert_keys + ['id']
+                try:
+                    new_ids = self._allocate_ids(len(chunk))
+                except DBQueryError as e:
+                    error_info = "从序列{0}预留主键失败\n{1}".format(self.get_sequence_name(), e)
+                    self.exec_state.failure(error_info)
+                    raise DBCreateError(error_info)
+
+                for insert_data, new_id in zip(chunk, new_ids):
+                    insert_data['id'] = new_id
+
+            if return_ids and 'id' in copy_keys:
+                ids.extend(insert_data['id'] for insert_data in chunk)
+
+            copy_sql = "copy {table_name} ({fields_sql}) from stdin with (format {copy_format})".format(
+                table_name=self.get_table_name_sql(),
+                fields_sql=", ".join(self.get_table_field_sql(key) for key in copy_keys),
+                copy_format=copy_format,
+            )
+            row_count += self.__copy_from(copy_sql, CopyRowStream(chunk, copy_keys, copy_format))
+
+        if not row_count:
+            self.exec_state.no_change("未创建任何内容")
+
+        return ids if return_ids else row_count
+
+    def _allocate_ids(self, count):
+        """从进程内预留的主键中取出 count 个, 不足时一次语句从序列中预留一批"""
+        return id_allocator.allocate((self.db_name, self.get_sequence_name()), count, self.__reserve_ids,
+                                     block_size=self.id_block_size)
+
+    def __reserve_ids(self, count):
+        rows = self.__execute("select nextval(%s) id from generate_series(1, %s)",
+                              params=(self.get_sequence_name(), count))
+        # 按位置读取, 兼容 RealDictCursor 和普通游标
+        return [next(iter(row.values())) if isinstance(row, dict) else row[0] for row in rows]
+
+    def __copy_from(self, copy_sql, stream, error_class=DBCreateError):
+        self.exec_state.reset_state()
+        try:
+            self.cur.copy_expert(copy_sql, stream, size=COPY_BUFFER_SIZE)
+        except PgError as e:
+            exception_info = "{0}.{1}: {2}".format(e.__module__, type(e).__name__, e.pgerror)
+            error_info = """DB执行COPY失败
+-----sql----------\n{0}
+-----end sql------\n{1}
+            """.format(copy_sql, exception_info).strip()
+            self.exec_state.failure(error_info)
+            raise error_class(error_info)
+
+        return stream.row_count
+
+    def __iter_chunks(self, rows, chunk_size, error_class=DBCreateError):
+        chunk = []
+        row_count = 0
+        rows = iter(rows)
+        while True:
+            # 调用方传入的行迭代器(如逐行解析文件的生成器)抛出的异常统一转换为 error_class
+            try:
+                row = next(rows)
+            except StopIteration:
+                break
+            except Exception as e:
+                exception_info = "{0}: {1}".format(type(e).__name__, str(e))
+                error_info = "读取第{0}行数据失败: {1}".format(row_count + 1, exception_info)
+                self.exec_state.failure(error_info)
+                raise error_class(error_info)
+
+            row_count += 1
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+
+        if chunk:
+            yield chunk
+
+    def batch_upsert(self, upsert_data_list, conflict_keys=None, update_keys=None, page_size=1000, fetch=False,
+                     return_fields=None):
+        """
+        使用 INSERT ... ON CONFLICT DO UPDATE 批量写入, 已存在的行更新, 一条语句完成查询, 创建和更新
+        :param conflict_keys: 判断冲突的唯一键, 默认 primary_keys
+        :param update_keys: 冲突时更新的字段, 默认除冲突键, 主键和创建审计字段外的全部字段
+        :param page_size：每次执行数量
+        :param fetch：是否返回 return_fields 的值
+        :param return_fields: 返回的字段, 默认 primary_keys
+        """
+        if not upsert_data_list:
+            return True
+
+        data_keys = upsert_data_list[0].keys()
+        if not data_keys:
+            error_info = "创建的数据字段为空"
+            self.exec_state.failure(error_info)
+            raise DBCreateError(error_info)
+
+        for upsert_data in upsert_data_list:
+            if data_keys != upsert_data.keys():
+                error_info = """创建的字段不一致:
+第一行: {0}
+异常行: {1}
+                """.format(",".join(data_keys), ",".join(upsert_data.keys()))
+                self.exec_state.failure(error_info)
+                raise DBCreateError(error_info)
+
+        conflict_keys = tuple(conflict_keys or self.primary_keys)
+        missing_keys = [key for key in conflict_keys if key not in data_keys]
+        if missing_keys and list(missing_keys) != list(self.primary_keys[:1]):
+            error_info = "冲突键不在数据中: {0}".format(",".join(missing_keys))
+            self.exec_state.failure(error_info)
+            raise DBCreateError(error_info)
+
+        upsert_sql, params, template = self._generate_batch_upsert_sql(upsert_data_list, conflict_keys,
+                                                                       update_keys=update_keys,
+                                                                       return_fields=(return_fields or self.primary_keys)
+                                                                       if fetch else None)
+        if not upsert_sql:
+            error_info = """生成SQL失败:{}""".format(str(upsert_data_list[0]))
+            if len(error_info) > 1048576:
+                # 如果错误信息大小超过1M, 就截取前后两512K的内容存取,防止意外的存储爆炸
+                error_info = error_info[:524288] + error_info[-524288:]
+
+            self.exec_state.failure(error_info)
+            raise DBCreateError(error_info)
+
+        return self._batch_create(upsert_sql, params=params, template=template, page_size=page_size, fetch=fetch)
+
     def delete(self, sc, return_fields=None):
         if not sc:
             error_info = "未设定删除条件"
@@ -282,13 +1147,210 @@ class BaseTable(object):
         return self._delete(delete_sql, params=params)
 
     def _delete(self, delete_sql, params=None):
-        rowcount = self.__execute(delete_sql, params=params, mode=DBExecMode.INSERT.name)
+        rowcount = self.__execute(delete_sql, params=params, mode=DBExecMode.DELETE.name)
         if not rowcount:
             self.exec_state.no_change("未删除任何内容")
 
-        return None
+        return rowcount
+
+    def batch_delete(self, keys=None, sc=None, key_field=None, chunk_size=1000, sleep=0, max_batches=None):
+        """
+        分块删除, 每块一条语句, 自动提交模式下每块单独提交, 缩短锁的持有时间, 避免单个大事务;
+        非自动提交模式下所有块在调用方的事务中执行
+        :param keys: 主键值列表, 按 key_field = ANY(%s) 分块删除
+        :param sc: 删除条件, 每次删除满足条件的 chunk_size 行, 直到没有满足条件的行
+        :param key_field: keys 对应的字段, 默认 primary_keys 的第一个字段
+        :param chunk_size: 每块删除的行数
+        :param sleep: 每块之间暂停的秒数, 给其他写入让出资源
+        :param max_batches: 按 sc 删除时最多执行的块数, 为空时删除全部满足条件的行
+        :return: 删除的总行数
+        """
+        if keys is None and not sc:
+            error_info = "未设定删除条件"
+            self.exec_state.failure(error_info)
+            raise DBDeleteError(error_info)
+
+        if keys is not None:
+            rowcount = self.__delete_by_keys(list(keys), key_field or self.primary_keys[0], chunk_size, sleep)
+        else:
+            rowcount, _, _ = self.__delete_by_condition(sc, chunk_size, sleep, max_batches)
+
+        if not rowcount:
+            self.exec_state.no_change("未删除任何内容")
+
+        return rowcount
+
+    def __delete_by_keys(self, keys, key_field, chunk_size, sleep):
+        self._check_fields([key_field], DBDeleteError)
+        delete_sql = "delete from {table_name} where {key_field} = any(%s)".format(
+            table_name=self.get_table_name_sql(),
+            key_field=self.get_table_field_sql(key_field),
+        )
+
+        rowcount = 0
+        for start in range(0, len(keys), chunk_size):
+            if start and sleep:
+                time.sleep(sleep)
+            rowcount += self.__execute(delete_sql, params=(keys[start:start + chunk_size],),
+                                       mode=DBExecMode.DELETE.name)
+        return rowcount
+
+    def __delete_by_condition(self, sc, chunk_size, sleep, max_batches=None):
+        """返回 (删除行数, 执行块数, 是否已删除全部满足条件的行)"""
+        condition_sql, params = self.__generate_condition_sql(sc)
+        if not condition_sql:
+            error_info = """生成SQL失败:{}""".format(str(sc))
+            if len(error_info) > 1048576:
+                # 如果错误信息大小超过1M, 就截取前后两512K的内容存取,防止意外的存储爆炸
+                error_info = error_info[:524288] + error_info[-524288:]
+
+            self.exec_state.failure(error_info)
+            raise DBDeleteError(error_info)
+
+        # 单字段主键用 = any(array(...)); 复合主键按整行主键比较, 分区表中 ctid 不唯一, 不能用于定位行
+        if len(self.primary_keys) == 1:
+            row_field = self.get_table_field_sql(self.primary_keys[0])
+            delete_sql = """delete from {table_name}
+             where {row_field} = any(array(
+                    select {row_field} from {table_name} where 1=1 {condition_sql} limit %s
+                   ))
+            """
+        else:
+            row_field = ", ".join(self.get_table_field_sql(key) for key in self.primary_keys)
+            delete_sql = """delete from {table_name}
+             where ({row_field}) in (
+                    select {row_field} from {table_name} where 1=1 {condition_sql} limit %s
+                   )
+            """
+        delete_sql = delete_sql.format(
+            table_name=self.get_table_name_sql(),
+            row_field=row_field,
+            condition_sql=condition_sql,
+        )
+        params = tuple(params or ()) + (chunk_size,)
+
+        rowcount = 0
+        batches = 0
+        while True:
+            chunk_rowcount = self.__execute(delete_sql, params=params, mode=DBExecMode.DELETE.name)
+            rowcount += chunk_rowcount
+            batches += 1
+            if chunk_rowcount < chunk_size:
+                return rowcount, batches, True
+            if max_batches and batches >= max_batches:
+                return rowcount, batches, False
+            if sleep:
+                time.sleep(sleep)
+
+    def purge_expired(self, batch_size=5000, sleep=0.1, max_batches=None, now=None):
+        """
+        按 retention_field 和 retention_days 分批删除过期的行
+        :param batch_size: 每批删除的行数
+        :param sleep: 每批之间暂停的秒数
+        :param max_batches: 本次最多执行的批数, 未删完的行留给下次执行
+        :param now: 计算过期时间的当前时间, 默认 datetime.now()
+        :return: {"table", "cutoff", "deleted", "batches", "finished", "elapsed"}
+        """
+        if not self.retention_field or not self.retention_days:
+            error_info = "表'{0}'未设置保留期限".format(self.table_name)
+            self.exec_state.failure(error_info)
+            raise DBDeleteError(error_info)
+
+        cutoff = (now or datetime.datetime.now()) - datetime.timedelta(days=self.retention_days)
+        sc = Sc([(self.retention_field, '<', cutoff)])
+
+        start_time = time.monotonic()
+        dropped_partitions = []
+        if self.partition_field == self.retention_field and self.is_partitioned():
+            # 整个分区都已过期时直接删除分区, 剩余的行再逐批删除
+            dropped_partitions = self.drop_expired_partitions(cutoff)
+
+        deleted, batches, finished = self.__delete_by_condition(sc, batch_size, sleep, max_batches)
+        elapsed = time.monotonic() - start_time
+        if not deleted and not dropped_partitions:
+            self.exec_state.no_change("未删除任何内容")
+
+        logger.info("清理表[%s]%s之前的数据: 删除%d个分区, %d行, %d批, 用时%.2f秒%s" % (
+            self.table_name, cutoff.isoformat(), len(dropped_partitions), deleted, batches, elapsed,
+            '' if finished else ', 未清理完'
+        ))
+        return {
+            "table": self.table_name, "cutoff": cutoff.isoformat(), "deleted": deleted, "batches": batches,
+            "finished": finished, "elapsed": round(elapsed, 3), "dropped_partitions": dropped_partitions,
+        }
+
+    def is_partitioned(self):
+        rows = self.__execute(PARTITION_RELKIND_SQL, params=(self.get_table_name_sql(),))
+        return bool(rows) and rows[0]['relkind'] == PARTITIONED_RELKIND
+
+    def list_partitions(self):
+        """返回 [(分区名, 下界, 上界)], 下界或上界为 MINVALUE/MAXVALUE 时为 None, 不包含 DEFAULT 分区"""
+        partitions = []
+        for row in self.__execute(PARTITION_LIST_SQL, params=(self.get_table_name_sql(),)):
+            bound = parse_range_bound(row['partition_bound'])
+            if bound is not None:
+                partitions.append((row['partition_name'], bound[0], bound[1]))
+        return partitions
+
+    def ensure_partitions(self, now=None):
+        """
+        创建当前时间所在的分区和之后 partition_premake 个分区, 已被现有分区覆盖的时间范围跳过
+        :return: 新创建的分区名列表, 表未分区时返回空列表
+        """
+        if not self.partition_field:
+            return []
+
+        if not self.is_partitioned():
+            logger.warning("表'%s'声明了分区字段'%s', 但不是分区表" % (self.table_name, self.partition_field))
+            return []
+
+        existing = self.list_partitions()
+        start = partition_start(now or datetime.datetime.now(), self.partition_interval)
+        created = []
+        for _ in range(self.partition_premake + 1):
+            end = next_partition_start(start, self.partition_interval)
+            covered = any(
+                (lower is None or lower < end) and (upper is None or upper > start) for _, lower, upper in existing
+            )
+            if not covered:
+                name = partition_name(self.table_name, start)
+                create_sql = "create table {partition} partition of {table_name} for values from (%s) to (%s)".format(
+                    partition='"%s"' % name,
+                    table_name=self.get_table_name_sql(),
+                )
+                self.__execute(create_sql, params=(start, end), mode=DBExecMode.UPDATE.name)
+                created.append(name)
+                logger.info("创建分区[%s]: %s ~ %s" % (name, start.isoformat(), end.isoformat()))
+            start = end
+
+        return created
+
+    def drop_expired_partitions(self, cutoff, detach_only=False):
+        """
+        分离并删除上界不晚于 cutoff 的分区, 只修改元数据, 不需要逐行删除
+        :param detach_only: 只分离不删除, 分离后的表可以单独归档
+        :return: 处理的分区名列表
+        """
+        dropped = []
+        for name, lower, upper in self.list_partitions():
+            if upper is None or upper > cutoff:
+                continue
+
+            partition_sql = '"%s"' % name
+            self.__execute("alter table {0} detach partition {1}".format(self.get_table_name_sql(), partition_sql),
+                           mode=DBExecMode.DELETE.name)
+            if not detach_only:
+                self.__execute("drop table {0}".format(partition_sql), mode=DBExecMode.DELETE.name)
+            dropped.append(name)
+            logger.info("%s分区[%s]: %s之前" % ('分离' if detach_only else '删除', name, upper.isoformat()))
+
+        return dropped
 
-    def write(self, update_dict, sc, return_fields=None):
+    def write(self, update_dict, sc, return_fields=None, skip_unchanged=False):
+        """
+        :param skip_unchanged: 只更新至少有一个数据字段发生变化的行, 未变化的行不会更新 write_date/write_uid,
+            此时返回 (变化行数, 未变化行数)
+        """
         if not update_dict:
             error_info = "更新内容为空"
             self.exec_state.failure(error_info)
@@ -299,7 +1361,7 @@ class BaseTable(object):
             self.exec_state.failure(error_info)
             raise DBUpdateError(error_info)
 
-        update_sql, params = self._generate_update_sql(update_dict, sc)
+        update_sql, params = self._generate_update_sql(update_dict, sc, skip_unchanged=skip_unchanged)
         if not update_sql:
             error_info = """生成SQL失败:{}""".format(str(sc))
             if len(error_info) > 1048576:
@@ -309,6 +1371,9 @@ class BaseTable(object):
             self.exec_state.failure(error_info)
             raise DBUpdateError(error_info)
 
+        if skip_unchanged:
+            return self._write_changed(update_sql, params=params)
+
         return self._write(update_sql, params=params)
 
     def _write(self, update_sql, params=None):
@@ -318,9 +1383,22 @@ class BaseTable(object):
 
         return None
 
+    def _write_changed(self, update_sql, params=None):
+        result = self.__execute(update_sql, params=params, mode=DBExecMode.UPDATE.name, fetch=True)
+        changed_count, matched_count = result[0]['changed_count'], result[0]['matched_count']
+        if not changed_count:
+            self.exec_state.no_change("未更新任何内容")
+
+        return changed_count, matched_count - changed_count
+
     def batch_write(self, update_data_list, condition_keys=None, data_keys=None, page_size=1000, fetch=False,
-                    field_type=None, return_fields=None):
+                    field_type=None, return_fields=None, skip_unchanged=False, staged=False,
+                    stage_chunk_size=None):
         """
+        :param skip_unchanged: 只更新至少有一个数据字段发生变化的行, 返回 (变化行数, 未变化行数),
+            未匹配到的行也计入未变化行数
+        :param staged: 先把数据 COPY 到会话临时表, 再用一条 UPDATE ... FROM 更新, 返回更新的行数, 适合大批量更新
+        :param stage_chunk_size: staged 时按临时表行号分段执行 UPDATE, 每段的行数, 为空时一次更新
         :param return_fields:
         :param data_keys:
         :param condition_keys:
@@ -351,9 +1429,15 @@ class BaseTable(object):
                 self.exec_state.failure(error_info)
                 raise DBUpdateError(error_info)
 
+        if staged:
+            return self._staged_batch_write(update_data_list, data_keys, condition_keys=condition_keys,
+                                            field_type=field_type, skip_unchanged=skip_unchanged,
+                                            chunk_size=stage_chunk_size)
+
         update_sql, params, template = self._generate_batch_update_sql(update_data_list, data_keys,
                                                                        condition_keys=condition_keys,
-                                                                       field_type=field_type)
+                                                                       field_type=field_type,
+                                                                       skip_unchanged=skip_unchanged)
         if not update_sql:
             error_info = """生成SQL失败:{}""".format(update_data_list[0])
             if len(error_info) > 1048576:
@@ -363,8 +1447,63 @@ class BaseTable(object):
             self.exec_state.failure(error_info)
             raise DBUpdateError(error_info)
 
+        if skip_unchanged:
+            # 分页执行时 rowcount 只是最后一页的数量, 通过 returning 统计所有页的变化行数
+            result = self._batch_write(update_sql, params=params, template=template, page_size=page_size, fetch=True)
+            return len(result), len(update_data_list) - len(result)
+
         return self._batch_write(update_sql, params=params, template=template, page_size=page_size, fetch=fetch)
 
+    def _staged_batch_write(self, update_data_list, data_keys, condition_keys=None, field_type=None,
+                            skip_unchanged=False, chunk_size=None):
+        stage_sql, update_sql, stage_table = self._generate_staged_update_sql(
+            update_data_list, data_keys, condition_keys=condition_keys, field_type=field_type,
+            skip_unchanged=skip_unchanged, chunked=bool(chunk_size)
+        )
+        if not update_sql:
+            error_info = """生成SQL失败:{}""".format(update_data_list[0])
+            if len(error_info) > 1048576:
+                # 如果错误信息大小超过1M, 就截取前后两512K的内容存取,防止意外的存储爆炸
+                error_info = error_info[:524288] + error_info[-524288:]
+
+            self.exec_state.failure(error_info)
+            raise DBUpdateError(error_info)
+
+        copy_keys = list(update_data_list[0].keys())
+        copy_sql = "copy {stage_table} ({fields_sql}) from stdin with (format {copy_format})".format(
+            stage_table=stage_table,
+            fields_sql=", ".join(self.get_table_field_sql(key) for key in copy_keys),
+            copy_format=COPY_FORMAT_TEXT,
+        )
+
+        self.__execute(stage_sql, mode=DBExecMode.UPDATE.name)
+        try:
+            row_count = self.__copy_from(copy_sql, CopyRowStream(update_data_list, copy_keys), DBUpdateError)
+            # 临时表不会被 autovacuum 分析, 没有统计信息时连接方式容易选错
+            self.__execute("analyze {0}".format(stage_table), mode=DBExecMode.UPDATE.name)
+
+            rowcount = 0
+            if chunk_size:
+                for start in range(1, row_count + 1, chunk_size):
+                    rowcount += self.__execute(update_sql, params=(start, start + chunk_size - 1),
+                                               mode=DBExecMode.UPDATE.name)
+            else:
+                rowcount = self.__execute(update_sql, mode=DBExecMode.UPDATE.name)
+        finally:
+            try:
+                self.cur.execute("drop table if exists {0}".format(stage_table))
+            except PgError:
+                # 事务已失败时无法删除, 临时表随事务回滚或会话结束删除
+                pass
+
+        if not rowcount:
+            self.exec_state.no_change("未更新任何内容")
+
+        if skip_unchanged:
+            return rowcount, row_count - rowcount
+
+        return rowcount
+
     def _batch_write(self, update_sql, params=None, template=None, page_size=1000, fetch=True):
         result = self.__execute(update_sql, params=params, template=template, page_size=page_size, fetch=fetch,
                                 mode=DBExecMode.BATCH_INSERT.name)
@@ -373,31 +1512,33 @@ class BaseTable(object):
 
         return result
 
-    def __execute(self, sql_str, params=None, mode=DBExecMode.QUERY.name, template=None, page_size=None, fetch=None):
+    def __execute(self, sql_str, params=None, mode=DBExecMode.QUERY.name, template=None, page_size=None, fetch=None,
+                  cursor=None):
+        """cursor: 使用指定的游标执行, 默认使用 self.cur"""
+        cur = cursor if cursor is not None else self.cur
         result = None
         error_info = None
         self.exec_state.reset_state()
-        params = params[1:]
         try:
             if mode in (DBExecMode.BATCH_UPDATE.name, DBExecMode.BATCH_INSERT.name):
                 if not isinstance(template, bytes) and template is not None:
-                    template = template.encode(extensions.encodings[self.cur.connection.encoding])
-                result = extras.execute_values(self.cur, sql_str, params, template=template, page_size=page_size,
+                    template = template.encode(extensions.encodings[cur.connection.encoding])
+                result = extras.execute_values(cur, sql_str, params, template=template, page_size=page_size,
                                                fetch=fetch)
                 if not fetch:
-                    result = self.cur.rowcount
+                    result = cur.rowcount
             else:
-                self.cur.execute(sql_str, params)
+                cur.execute(sql_str, params)
                 if mode == DBExecMode.QUERY.name:
-                    result = self.cur.fetchall()
+                    result = cur.fetchall()
                 elif mode == DBExecMode.UPDATE.name:
-                    result = self.cur.rowcount
+                    result = cur.fetchall() if fetch else cur.rowcount
                 elif mode == DBExecMode.INSERT.name:
-                    result = self.cur.fetchone()
+                    result = cur.fetchone()
                 elif mode == DBExecMode.DELETE.name:
-                    result = self.cur.rowcount
+                    result = cur.rowcount
         except PgError as e:
-            full_sql = self.mogrify(sql_str, params, template=template)
+            full_sql = self.mogrify(sql_str, params, template=template, cursor=cur)
             exception_info = "{0}.{1}: {2}".format(e.__module__, type(e).__name__, e.pgerror)
             error_info = """DB执行SQL失败
 -----sql----------\n{0}
@@ -440,18 +1581,20 @@ params: {1}
 
         return result
 
-    def mogrify(self, sql_str, params=None, template=None):
+    def mogrify(self, sql_str, params=None, template=None, cursor=None):
+        cur = cursor if cursor is not None else self.cur
         if not template:
-            return self.cur.mogrify(sql_str, params)
+            return cur.mogrify(sql_str, params)
         else:
-            return self.cur.mogrify(sql_str, params)
+            return cur.mogrify(sql_str, params)
 
     def _get_permissions_condition(self):
         return True, []
 
     def _generate_query_field_sql(self, fields=None, distinct=False):
         if not fields:
-            fields = []
+            distinct = False
+            fields = self.get_column_registry().default_fields or []
 
         sql_query_fields = []
         for f in fields:
@@ -467,15 +1610,67 @@ params: {1}
 
         return field_sql
 
-    def _generate_query_sql(self, sc, fields=None, offset=None, limit=None, order_by=None, count=None, distinct=None):
+    def _generate_query_sql(self, sc, fields=None, offset=None, limit=None, order_by=None, count=None, distinct=None,
+                            seek_keys=None, seek_values=None, seek_desc=False):
+        """
+        :param seek_keys: 键集分页的排序键, 设置后按这些键排序并忽略 order_by
+        :param seek_values: 上一页最后一行的排序键值, 为空时从第一行开始
+        :param seek_desc: 键集分页是否倒序
+        """
         success, permissions_condition = self._get_permissions_condition()
         if not success:
             return False, None
 
         sc.add_conditions(permissions_condition)
+        conditions = self.__normalize_conditions(sc)
+
+        offset = offset if isinstance(offset, int) else None
+        limit = limit if isinstance(limit, int) else None
+        fields = tuple(fields) if fields else None
+        seek = (tuple(seek_keys), bool(seek_values), bool(seek_desc)) if seek_keys else None
+        statement_key = (
+            self.__condition_shape(conditions), fields, bool(distinct), order_by,
+            offset is not None, limit is not None, bool(count), seek,
+        )
+
+        sql_cache = self.get_sql_cache()
+        select_sql = sql_cache.get(statement_key)
+        if select_sql is None:
+            select_sql = self.__compile_query_sql(statement_key)
+            sql_cache.set(statement_key, select_sql)
+
+        paras = self.__bind_condition_params(conditions)
+        if seek and seek_values:
+            paras.extend(seek_values)
+        if offset is not None:
+            paras.append(offset)
+        if limit is not None:
+            paras.append(limit)
+
+        return select_sql, tuple(paras) if paras else None
+
+    def __compile_query_sql(self, statement_key):
+        condition_shape, fields, distinct, order_by, has_offset, has_limit, count, seek = statement_key
+
+        self._check_fields(fields or ())
+        self._check_fields([f for condition_fields, operate in condition_shape if operate != SQL_OR
+                            for f in condition_fields])
+        if seek:
+            self._check_fields(seek[0])
 
         field_sql = self._generate_query_field_sql(fields, distinct)
-        condition_sql, paras = self.__generate_condition_sql(sc)
+        condition_sql = self.__compile_condition_sql(condition_shape)
+
+        if seek:
+            seek_keys, has_seek_values, seek_desc = seek
+            direction = " desc" if seek_desc else ""
+            order_by = ",".join(self.get_table_field_sql(k) + direction for k in seek_keys)
+            if has_seek_values:
+                condition_sql += " And ({0}) {1} ({2})".format(
+                    ",".join(self.get_table_field_sql(k) for k in seek_keys),
+                    "<" if seek_desc else ">",
+                    ",".join("%s" for _ in seek_keys),
+                )
 
         select_sql = """select {field_sql}
               from {table_name}
@@ -490,16 +1685,16 @@ params: {1}
         if not count and order_by:
             select_sql += " Order By {order_by}".format(order_by=order_by)
 
-        if isinstance(offset, int):
-            select_sql += " Offset {offset}".format(offset=offset)
+        if has_offset:
+            select_sql += " Offset %s"
 
-        if isinstance(limit, int):
-            select_sql += " Limit {limit}".format(limit=limit)
+        if has_limit:
+            select_sql += " Limit %s"
 
         if count:
             select_sql = " select count(1) count from ({select_sql}) t".format(select_sql=select_sql)
 
-        return select_sql, paras
+        return select_sql
 
     def __done_special_query_condition(self, conditions):
         if not conditions:
@@ -541,12 +1736,12 @@ params: {1}
     def _generate_insert_sql(self, insert_data):
         insert_fields = []
         insert_paras = []
-        parameter_list = []
 
         self.__remove_extra_field(insert_data)
         self.__add_extra_value(insert_data)
+        self._check_fields(insert_data.keys(), DBCreateError)
 
-        if self.db_type == DBType.Postgresql.value and self.primary_keys:
+        if self.db_type == DBType.Postgresql.value and self.primary_keys and self.primary_keys[0] not in insert_data:
             insert_fields.append(self.primary_keys[0])
             insert_paras.append("nextval('%s_id_seq')" % self.table_name)
 
@@ -554,11 +1749,7 @@ params: {1}
             insert_fields.append(key)
             insert_paras.append('%s')
 
-            field_value = insert_data[key]
-            if isinstance(field_value, (dict, list)):
-                field_value = json.dumps(field_value)
-
-            parameter_list.append(field_value)
+        parameter_list = self.__adapt_values(list(insert_data.values()), self.__json_indexes(insert_data.keys()))
 
         if not insert_fields:
             return False, False
@@ -585,61 +1776,125 @@ params: {1}
 
         return insert_sql, tuple(parameter_list)
 
-    def _generate_batch_insert_sql(self, insert_data_list):
+    def _generate_batch_insert_sql(self, insert_data_list, return_fields=None):
         for insert_data in insert_data_list:
+            self.__remove_extra_field(insert_data)
             self.__add_extra_value(insert_data)
 
+        if self.db_type == DBType.Postgresql.value and self.primary_keys[0] == 'id' \
+                and 'id' not in insert_data_list[0]:
+            # 主键从本地预留的序列值中分配, 不在每行中调用 nextval
+            for insert_data, new_id in zip(insert_data_list, self._allocate_ids(len(insert_data_list))):
+                insert_data['id'] = new_id
+
         insert_keys = list(insert_data_list[0].keys())
+        self._check_fields(insert_keys, DBCreateError)
+        json_indexes = self.__json_indexes(insert_keys)
 
         data_list = []
         for insert_data in insert_data_list:
-            self.__add_extra_value(insert_data)
-            self.__remove_extra_field(insert_data)
-
-            create_data_list = []
-            for key in insert_keys:
-                value = insert_data.get(key)
-                if isinstance(insert_data.get(key), (dict, list)):
-                    value = json.dumps(value)
-                create_data_list.append(value)
-
-            data_list.append(tuple(create_data_list))
+            create_data_list = [insert_data.get(key) for key in insert_keys]
+            data_list.append(tuple(self.__adapt_values(create_data_list, json_indexes)))
 
         template_keys = ', '.join('%s' for _ in range(len(insert_keys)))
-        tail_sql = ""
-        if self.db_type == DBType.Postgresql.value and self.primary_keys[0] == 'id':
-            insert_keys.append(self.primary_keys[0])
-            template_keys += ", nextval('{0}_id_seq')".format(self.table_name)
-            tail_sql = ' %s '
+        tail_sql = ' %s '
+
+        return_sql = ""
+        if return_fields:
+            return_sql = " Returning " + ",".join(self.get_table_field_sql(f) for f in return_fields)
 
         insert_sql = """
             Insert Into {table_name}
             ({fields_sql}) 
             values
             {tail_sql}
+            {return_sql}
         """.format(
             table_name=self.get_table_name_sql(),
             fields_sql=", ".join(self.get_table_field_sql(key) for key in insert_keys),
             tail_sql=tail_sql,
+            return_sql=return_sql,
         )
 
         template = '(' + template_keys + ')'
 
         return insert_sql, data_list, template
 
-    def _generate_update_sql(self, update_data=None, condition=None):
+    def _generate_batch_upsert_sql(self, upsert_data_list, conflict_keys, update_keys=None, return_fields=None):
+        for upsert_data in upsert_data_list:
+            self.__remove_extra_field(upsert_data)
+            self.__add_extra_value(upsert_data)
+
+        insert_keys = list(upsert_data_list[0].keys())
+        self._check_fields(insert_keys, DBCreateError)
+        json_indexes = self.__json_indexes(insert_keys)
+
+        # 同一条语句中不能两次更新同一行, 冲突键重复时保留最后一行
+        data_dict = OrderedDict()
+        for upsert_data in upsert_data_list:
+            values = self.__adapt_values([upsert_data.get(key) for key in insert_keys], json_indexes)
+            conflict_value = tuple(upsert_data.get(key) for key in conflict_keys)
+            if None in conflict_value:
+                conflict_value = (len(data_dict), None)
+            data_dict.pop(conflict_value, None)
+            data_dict[conflict_value] = tuple(values)
+        data_list = list(data_dict.values())
+
+        template_keys = ', '.join('%s' for _ in insert_keys)
+        if self.db_type == DBType.Postgresql.value and self.primary_keys[0] == 'id' and 'id' not in insert_keys:
+            # 与 batch_create 一样从本地预留的序列值中分配主键, 冲突后更新的行不使用分配的主键
+            insert_keys.append(self.primary_keys[0])
+            template_keys += ', %s'
+            data_list = [values + (new_id,) for values, new_id in zip(data_list, self._allocate_ids(len(data_list)))]
+
+        if update_keys is None:
+            skip_keys = set(conflict_keys) | set(self.primary_keys) | set(CREATE_LOG_FIELDS)
+            update_keys = [key for key in insert_keys if key not in skip_keys]
+        else:
+            update_keys = list(update_keys)
+            if self.__log_field:
+                update_keys.extend(key for key in ('write_date', 'write_uid') if key not in update_keys)
+
+        if update_keys:
+            conflict_action_sql = "do update set " + ", ".join(
+                "{0} = excluded.{0}".format(self.get_table_field_sql(key)) for key in update_keys
+            )
+        else:
+            conflict_action_sql = "do nothing"
+
+        return_sql = ""
+        if return_fields:
+            return_sql = " Returning " + ",".join(self.get_table_field_sql(f) for f in return_fields)
+
+        upsert_sql = """
+            Insert Into {table_name}
+            ({fields_sql})
+            values %s
+            on conflict ({conflict_sql}) {conflict_action_sql}
+            {return_sql}
+        """.format(
+            table_name=self.get_table_name_sql(),
+            fields_sql=", ".join(self.get_table_field_sql(key) for key in insert_keys),
+            conflict_sql=", ".join(self.get_table_field_sql(key) for key in conflict_keys),
+            conflict_action_sql=conflict_action_sql,
+            return_sql=return_sql,
+        )
+
+        return upsert_sql, data_list, '(' + template_keys + ')'
+
+    def _generate_update_sql(self, update_data=None, condition=None, skip_unchanged=False):
         self.__remove_extra_field(update_data)
+        compare_keys = [key for key in update_data.keys() if key not in WRITE_LOG_FIELDS]
         self.__add_extra_value(update_data, mode=DBExecMode.UPDATE.name)
 
-        set_sql_list = []
-        params = []
-        for field_name, field_value in update_data.items():
-            if isinstance(field_value, (dict, list)):
-                field_value = json.dumps(field_value)
+        self._check_fields(update_data.keys(), DBUpdateError)
 
+        set_sql_list = []
+        for field_name in update_data.keys():
             set_sql = self.get_table_field_sql(field_name) + ' = %s '
             set_sql_list.append(set_sql)
-            params.append(field_value)
+
+        params = self.__adapt_values(list(update_data.values()), self.__json_indexes(update_data.keys()))
 
         where_sql, where_params = self.__generate_condition_sql(condition)
 
@@ -651,6 +1906,10 @@ params: {1}
             self.error_message = "未设置更新条件"
             return None, None
 
+        if skip_unchanged:
+            return self.__generate_changed_update_sql(update_data, compare_keys, set_sql_list, params, where_sql,
+                                                      where_params)
+
         params.extend(where_params)
 
         update_sql = """update {table_name}
@@ -664,23 +1923,123 @@ params: {1}
         )
         return update_sql, tuple(params)
 
-    def _generate_batch_update_sql(self, update_data_list, data_keys, condition_keys=None, field_type=None):
-        if not field_type:
-            field_type = {}
+    def __generate_changed_update_sql(self, update_data, compare_keys, set_sql_list, set_params, where_sql,
+                                      where_params):
+        """只更新有字段变化的行, 同时统计条件匹配的行数
+
+        CTE 与外层查询使用同一快照, matched 统计的是更新前满足条件的行
+        """
+        if not compare_keys:
+            self.error_message = "未设置更新内容"
+            return None, None
+
+        json_keys = self.__compare_json_keys()
+        distinct_sql = self.__generate_distinct_sql(
+            compare_keys, self.get_table_name_sql(), lambda key: '%s::jsonb' if key in json_keys else '%s', json_keys
+        )
+        compare_params = [set_params[list(update_data.keys()).index(key)] for key in compare_keys]
+
+        where_params = list(where_params or ())
+        params = list(set_params) + where_params + compare_params + where_params
+
+        update_sql = """with changed as (
+                update {table_name}
+                   set {set_sql}
+                 where 1=1
+                       {where_sql}
+                   and ({distinct_sql})
+             returning 1
+            )
+            select (select count(1) from changed) as changed_count,
+                   (select count(1) from {table_name} where 1=1 {where_sql}) as matched_count
+        """.format(
+            table_name=self.get_table_name_sql(),
+            set_sql=','.join(set_sql_list),
+            where_sql=where_sql,
+            distinct_sql=distinct_sql,
+        )
+        return update_sql, tuple(params)
 
+    def __compare_json_keys(self, field_type=None):
+        """需要按 jsonb 比较的字段, json 类型没有相等运算符"""
+        json_keys = set(self.get_column_registry().json_columns)
+        json_keys.update((field_type or {}).get('json') or [])
+        return json_keys
+
+    def __generate_distinct_sql(self, keys, table_sql, right_sql, json_keys):
+        """生成 (左 is distinct from 右 or ...), right_sql 为根据字段名返回右侧表达式的函数"""
+        distinct_sql_list = []
+        for key in keys:
+            left_sql = '{0}.{1}'.format(table_sql, self.get_table_field_sql(key))
+            if key in json_keys:
+                left_sql += '::jsonb'
+            distinct_sql_list.append('{0} is distinct from {1}'.format(left_sql, right_sql(key)))
+        return ' or '.join(distinct_sql_list)
+
+    def _generate_batch_update_sql(self, update_data_list, data_keys, condition_keys=None, field_type=None,
+                                   skip_unchanged=False):
         data_list = []
+        json_indexes = None
         for update_data in update_data_list:
             self.__remove_extra_field(update_data)
             self.__add_extra_value(update_data, mode=DBExecMode.UPDATE.name)
 
-            update_data_list = []
-            for key in data_keys:
-                value = update_data.get(key)
-                if isinstance(update_data.get(key), (dict, list)):
-                    value = json.dumps(value)
-                update_data_list.append(value)
+            if json_indexes is None:
+                # data_keys 可能是第一行的 keys 视图, 在补充审计字段后再检查
+                self._check_fields(data_keys, DBUpdateError)
+                json_indexes = self.__json_indexes(data_keys)
 
-            data_list.append(tuple(update_data_list))
+            update_values = [update_data.get(key) for key in data_keys]
+            data_list.append(tuple(self.__adapt_values(update_values, json_indexes)))
+
+        update_sql, type_dict = self.__compile_batch_update_sql(data_keys, condition_keys=condition_keys,
+                                                                field_type=field_type, skip_unchanged=skip_unchanged)
+        if not update_sql:
+            return False, False, False
+
+        template = '(' + ','.join('%s' + (type_dict.get(key) or '') for key in data_keys) + ')'
+
+        return update_sql, data_list, template
+
+    def _generate_staged_update_sql(self, update_data_list, data_keys, condition_keys=None, field_type=None,
+                                    skip_unchanged=False, chunked=False):
+        """生成暂存表的建表SQL和 UPDATE ... FROM 暂存表的SQL, chunked 时 UPDATE 带行号区间参数"""
+        for update_data in update_data_list:
+            self.__remove_extra_field(update_data)
+            self.__add_extra_value(update_data, mode=DBExecMode.UPDATE.name)
+
+        data_keys = list(data_keys)
+        self._check_fields(data_keys, DBUpdateError)
+
+        stage_table = 'pcs_stage_%s' % uuid.uuid4().hex
+        update_sql, type_dict = self.__compile_batch_update_sql(data_keys, condition_keys=condition_keys,
+                                                                field_type=field_type, skip_unchanged=skip_unchanged,
+                                                                stage_table=stage_table, chunked=chunked)
+        if not update_sql:
+            return False, False, False
+
+        # 暂存表的字段类型与目标表一致, field_type 指定的字段按指定类型创建
+        select_sql = ','.join(
+            '{0}{1} as {0}'.format(self.get_table_field_sql(key), type_dict.get(key) or '') for key in data_keys
+        )
+        stage_sql = """
+            create temp table {stage_table} as select {select_sql} from {table_name} with no data;
+            alter table {stage_table} add column {row_no_field} bigserial {primary_key_sql};
+        """.format(
+            stage_table=stage_table,
+            select_sql=select_sql,
+            table_name=self.get_table_name_sql(),
+            row_no_field=STAGE_ROW_NO_FIELD,
+            primary_key_sql='primary key' if chunked else '',
+        )
+
+        return stage_sql, update_sql, stage_table
+
+    def __compile_batch_update_sql(self, data_keys, condition_keys=None, field_type=None, skip_unchanged=False,
+                                   stage_table=None, chunked=False):
+        """stage_table 为空时从 values 列表更新, 否则从暂存表更新, 返回 (SQL, {字段: 类型转换})"""
+        if not field_type:
+            field_type = {}
 
         if not condition_keys:
             condition_keys = []
@@ -700,24 +2059,51 @@ params: {1}
 
         if not set_sql_list:
             self.error_message = "未设置更新内容"
-            return False, False, False
+            return False, False
 
         if not where_sql_list:
             self.error_message = "未设置更新条件"
-            return False, False, False
+            return False, False
+
+        returning_sql = ''
+        if skip_unchanged:
+            compare_keys = [key for key in data_keys if key not in WRITE_LOG_FIELDS and key not in condition_keys]
+            if not compare_keys:
+                self.error_message = "未设置更新内容"
+                return False, False
+
+            json_keys = self.__compare_json_keys(field_type)
+            distinct_sql = self.__generate_distinct_sql(
+                compare_keys, self.get_table_name_sql(),
+                lambda key: 'dt.{0}{1}'.format(self.get_table_field_sql(key), '::jsonb' if key in json_keys else ''),
+                json_keys
+            )
+            where_sql_list.append(' And ({0}) '.format(distinct_sql))
+            if not stage_table:
+                # 分页执行时 rowcount 只是最后一页的数量, 通过 returning 统计所有页的变化行数
+                returning_sql = ' returning 1 '
+
+        if stage_table:
+            from_sql = '{0} as dt'.format(stage_table)
+            if chunked:
+                where_sql_list.append(' And dt.{0} between %s and %s '.format(STAGE_ROW_NO_FIELD))
+        else:
+            key_sql = ','.join(self.get_table_field_sql(key) for key in data_keys)
+            from_sql = '(values %s) as dt ({0})'.format(key_sql)
 
-        key_sql = ','.join(self.get_table_field_sql(key) for key in data_keys)
         update_sql = """
             update {table_name}
                set {set_sql}
-              from (values %s) as dt ({key_sql})
+              from {from_sql}
              where 1=1
                    {where_sql}
+                   {returning_sql}
         """.format(
             table_name=self.get_table_name_sql(),
             set_sql=','.join(set_sql_list),
-            key_sql=key_sql,
+            from_sql=from_sql,
             where_sql=' '.join(where_sql_list),
+            returning_sql=returning_sql,
         )
 
         type_dict = {
@@ -725,9 +2111,15 @@ params: {1}
             for data_type in field_type.keys()
             for f in (field_type.get(data_type) or []) if data_type in SQL_TYPE_MAP.keys()
         }
-        template = '(' + ','.join('%s' + (type_dict.get(key) or '') for key in data_keys) + ')'
+        if not stage_table:
+            registry = self.get_column_registry()
+            for key in data_keys:
+                column_type = registry.get_type(key)
+                if key not in type_dict and column_type:
+                    # values 中的参数没有类型, 表结构已知时按字段类型转换
+                    type_dict[key] = '::' + column_type
 
-        return update_sql, data_list, template
+        return update_sql, type_dict
 
     def _generate_delete_sql(self, condition):
         condition_sql, paras = self.__generate_condition_sql(condition)
@@ -736,18 +2128,39 @@ params: {1}
          where 1= 1
          {condition_sql}
                 """.format(
-            table_name=self.table_name,
+            table_name=self.get_table_name_sql(),
             condition_sql=condition_sql,
         )
         return delete_sql, paras
 
+    def __json_indexes(self, keys):
+        """JSON字段在 keys 中的位置, 表结构未知时返回 None"""
+        registry = self.get_column_registry()
+        if not registry.known:
+            return None
+        return [index for index, key in enumerate(keys) if key in registry.json_columns]
+
+    @staticmethod
+    def __adapt_values(values, json_indexes):
+        """表结构已知时只适配JSON字段的值, 未知时按值的类型判断"""
+        if json_indexes is None:
+            for index, value in enumerate(values):
+                if isinstance(value, (dict, list)):
+                    values[index] = json.dumps(value)
+        else:
+            for index in json_indexes:
+                values[index] = adapt_json(values[index])
+        return values
+
     def __add_extra_value(self, value_dict, mode=DBExecMode.INSERT.name):
         if mode == DBExecMode.INSERT.name:
             if self.__log_field:
-                value_dict.update({
-                    'write_date': datetime.datetime.now(), 'write_uid': self.user_id,
-                    'create_date': datetime.datetime.now(), 'create_uid': self.user_id,
-                })
+                # 只补充缺少的审计字段, 延迟写入的记录保留入队时的时间和用户
+                now = datetime.datetime.now()
+                for key, value in (('write_date', now), ('write_uid', self.user_id),
+                                   ('create_date', now), ('create_uid', self.user_id)):
+                    if value_dict.get(key) is None:
+                        value_dict[key] = value
 
             for key in self.default_value.keys():
                 if key in value_dict.keys():
@@ -764,26 +2177,26 @@ params: {1}
         value_dict.pop(SAVE_FLAG, None)
 
     def __generate_condition_sql(self, sc):
-        conditions = sc.condition
-        conditions = self.__done_special_query_condition(conditions)
+        conditions = self.__normalize_conditions(sc)
+        condition_sql = self.__compile_condition_sql(self.__condition_shape(conditions))
+        paras = self.__bind_condition_params(conditions)
 
-        like_operate = self.like_operate
-        regex_operate = self.regex_operate
-        not_regex_operate = self.not_regex_operate
+        return condition_sql, tuple(paras) if paras else None
 
-        sql_condition_list = []
-        sql_condition_value_list = []
-        operate_or_count = 0
-        operate_or_used_count = 0
+    def __normalize_conditions(self, sc):
+        """展开特殊条件, 并过滤无法识别的条件, 返回 [(字段元组, 操作符, 值)]"""
+        conditions = self.__done_special_query_condition(sc.condition)
+
+        normalized_conditions = []
         for condition in conditions:
             field = condition.get(SQL_QUERY_FIELD)
             operate = condition.get(SQL_QUERY_OPERATE)
             value = condition.get(SQL_QUERY_VALUE)
 
             if isinstance(field, str):
-                fields = [field]
+                fields = (field,)
             elif isinstance(field, list):
-                fields = field
+                fields = tuple(field)
             else:
                 continue
 
@@ -791,6 +2204,24 @@ params: {1}
                 continue
                 # raise Exception("未知的操作符'{operate}'".format(operate=operate))
 
+            normalized_conditions.append((fields, operate, value))
+
+        return normalized_conditions
+
+    @staticmethod
+    def __condition_shape(conditions):
+        """条件的形态: 只包含字段与操作符, 与绑定的值无关"""
+        return tuple((fields, operate) for fields, operate, _ in conditions)
+
+    def __compile_condition_sql(self, condition_shape):
+        like_operate = self.like_operate
+        regex_operate = self.regex_operate
+        not_regex_operate = self.not_regex_operate
+
+        sql_condition_list = []
+        operate_or_count = 0
+        operate_or_used_count = 0
+        for fields, operate in condition_shape:
             if operate == SQL_OR:
                 if operate_or_count == 0:
                     operate_or_count += 2
@@ -802,36 +2233,30 @@ params: {1}
             fields_sql_list = []
             for f in fields:
                 field_str = self.get_table_field_sql(f)
-                if 'llike' == lower_operate:
-                    operate_str = like_operate
-                    sql_condition_value_list.append("%" + value)
-                elif lower_operate in ('like', 'ilike'):
+                if lower_operate in ('llike', 'like', 'ilike', 'rlike'):
                     operate_str = like_operate
-                    sql_condition_value_list.append("%" + value + "%")
-                elif 'rlike' == lower_operate:
-                    operate_str = like_operate
-                    sql_condition_value_list.append(value + "%")
                 elif lower_operate in ('not like', 'not ilike'):
                     operate_str = ' not ' + like_operate
-                    sql_condition_value_list.append("%" + value + "%")
                 elif 'regular_exp' == lower_operate:
                     operate_str = regex_operate
-                    sql_condition_value_list.append(value)
                 elif 'not regular_exp' == lower_operate:
                     operate_str = not_regex_operate
-                    sql_condition_value_list.append(value)
                 elif 'null' == lower_operate:
-                    operate_str = 'is null'
+                    fields_sql_list.append(" {0} is null ".format(field_str))
+                    continue
                 elif 'not null' == lower_operate:
-                    operate_str = 'is not null'
+                    fields_sql_list.append(" {0} is not null ".format(field_str))
+                    continue
                 elif lower_operate in ('in', 'not in'):
                     operate_str = lower_operate
-                    if isinstance(value, str):
-                        value = eval(value)
-                    sql_condition_value_list.append(tuple(value))
                 else:
                     operate_str = operate
-                    sql_condition_value_list.append(value)
+
+                if f == self.partition_field and operate in SQL_PARTITION_PRUNE_OPERATES:
+                    # 参数转换为分区字段的类型, 字符串参数也能在生成执行计划时裁剪分区
+                    partition_type = self.get_column_registry().get_type(f) or 'timestamp'
+                    fields_sql_list.append(" {0} {1} %s::{2} ".format(field_str, operate_str, partition_type))
+                    continue
 
                 fields_sql_list.append(" {0} {1} %s ".format(field_str, operate_str))
 
@@ -859,14 +2284,34 @@ params: {1}
         if operate_or_count > 0:
             sql_condition_list.append(")")
 
-        condition_sql = ''
-        paras = None
+        return str.join(' ', sql_condition_list)
+
+    @staticmethod
+    def __bind_condition_params(conditions):
+        sql_condition_value_list = []
+        for fields, operate, value in conditions:
+            if operate == SQL_OR:
+                continue
+
+            lower_operate = operate.lower()
+            if 'llike' == lower_operate:
+                param = "%" + value
+            elif lower_operate in ('like', 'ilike', 'not like', 'not ilike'):
+                param = "%" + value + "%"
+            elif 'rlike' == lower_operate:
+                param = value + "%"
+            elif lower_operate in ('null', 'not null'):
+                continue
+            elif lower_operate in ('in', 'not in'):
+                if isinstance(value, str):
+                    value = eval(value)
+                param = tuple(value)
+            else:
+                param = value
 
-        if sql_condition_list:
-            condition_sql = str.join(' ', sql_condition_list)
-            paras = tuple(sql_condition_value_list)
+            sql_condition_value_list.extend(param for _ in fields)
 
-        return condition_sql, paras
+        return sql_condition_value_list
 
 
 class ExecuteState:
@@ -0,0 +1,77 @@
+from collections import OrderedDict
+import datetime
+import logging
+
+try:
+    import numpy as np
+except ImportError:  # numpy 只在列式查询时需要
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# PostgreSQL 类型 OID 对应的 numpy 类型
+PG_INT_TYPES = {20: 'int64', 21: 'int16', 23: 'int32', 26: 'int64'}
+PG_FLOAT_TYPES = {700: 'float32', 701: 'float64', 1700: 'float64'}
+PG_BOOL_TYPE = 16
+PG_TIMESTAMP_TYPE = 1114
+PG_TIMESTAMPTZ_TYPE = 1184
+PG_DATE_TYPE = 1082
+
+
+def _naive_utc(value):
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+
+class ColumnarBuilder:
+    """把游标分批返回的元组行按列转换为 numpy 数组
+
+    整数列出现 NULL 时转为 float64 (NaN), 布尔列出现 NULL 时转为 object,
+    时间列的 NULL 为 NaT, 带时区的时间统一转换为 UTC, numeric 转为 float64, 其余类型为 object
+    """
+
+    def __init__(self, description):
+        if np is None:
+            raise ImportError("列式查询需要安装 numpy")
+
+        self.columns = [column.name for column in description]
+        self.type_codes = [column.type_code for column in description]
+        self.__chunks = [[] for _ in self.columns]
+
+    def append(self, rows):
+        for i, type_code in enumerate(self.type_codes):
+            values = [row[i] for row in rows]
+            self.__chunks[i].append(self._to_array(values, type_code))
+
+    def build(self):
+        result = OrderedDict()
+        for name, type_code, chunks in zip(self.columns, self.type_codes, self.__chunks):
+            if not chunks:
+                chunks = [self._to_array([], type_code)]
+            result[name] = chunks[0] if len(chunks) == 1 else np.concatenate(chunks)
+        return result
+
+    @staticmethod
+    def _to_array(values, type_code):
+        if type_code in PG_INT_TYPES:
+            if None in values:
+                return np.array(values, dtype='float64')
+            return np.array(values, dtype=PG_INT_TYPES[type_code])
+
+        if type_code in PG_FLOAT_TYPES:
+            return np.array(values, dtype=PG_FLOAT_TYPES[type_code])
+
+        if type_code == PG_BOOL_TYPE and None not in values:
+            return np.array(values, dtype='bool')
+
+        if type_code == PG_TIMESTAMP_TYPE:
+            return np.array(values, dtype='datetime64[us]')
+
+        if type_code == PG_TIMESTAMPTZ_TYPE:
+            return np.array([_naive_utc(v) for v in values], dtype='datetime64[us]')
+
+        if type_code == PG_DATE_TYPE:
+            return np.array(values, dtype='datetime64[D]')
+
+        return np.fromiter(values, dtype=object, count=len(values))
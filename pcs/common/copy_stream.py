@@ -0,0 +1,101 @@
+from pcs.common.json_adapter import json_dumps
+import datetime
+import csv
+import io
+import logging
+
+logger = logging.getLogger(__name__)
+
+COPY_FORMAT_TEXT = 'text'
+COPY_FORMAT_CSV = 'csv'
+COPY_FORMATS = (COPY_FORMAT_TEXT, COPY_FORMAT_CSV)
+
+COPY_TEXT_NULL = '\\N'
+COPY_TEXT_ESCAPE = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+
+def format_copy_value(value):
+    """将Python值转换为COPY可解析的文本, None 由调用方处理"""
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, int):
+        return str(value)
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (dict, list)):
+        return json_dumps(value)
+    return str(value)
+
+
+def _format_text_value(value):
+    value_type = type(value)
+    if value_type is str:
+        return value.translate(COPY_TEXT_ESCAPE)
+    if value is None:
+        return COPY_TEXT_NULL
+    if value_type is int or value_type is datetime.datetime:
+        # 不会包含需要转义的字符
+        return format_copy_value(value)
+    return format_copy_value(value).translate(COPY_TEXT_ESCAPE)
+
+
+class CopyRowStream:
+    """把行迭代器包装为 COPY FROM STDIN 可读取的文件对象, 每次 read 时才编码需要的行
+
+    rows: 可迭代的行, 每行是字典
+    fields: 写入的字段顺序
+    """
+
+    def __init__(self, rows, fields, copy_format=COPY_FORMAT_TEXT):
+        if copy_format not in COPY_FORMATS:
+            raise ValueError("不支持的COPY格式'{0}'".format(copy_format))
+
+        self.fields = list(fields)
+        self.copy_format = copy_format
+        self.row_count = 0
+        self.__rows = iter(rows)
+        self.__buffer = ''
+        self.__exhausted = False
+        if copy_format == COPY_FORMAT_CSV:
+            self.__csv_buffer = io.StringIO()
+            self.__csv_writer = csv.writer(self.__csv_buffer, quoting=csv.QUOTE_NONNUMERIC, lineterminator='\n')
+
+    def _encode_row(self, row):
+        values = [row.get(f) for f in self.fields]
+        if self.copy_format == COPY_FORMAT_CSV:
+            # QUOTE_NONNUMERIC 下 None 输出为不带引号的空值, 即 COPY CSV 的 NULL
+            self.__csv_writer.writerow([
+                v if v is None or (isinstance(v, (int, float)) and not isinstance(v, bool)) else format_copy_value(v)
+                for v in values
+            ])
+            line = self.__csv_buffer.getvalue()
+            self.__csv_buffer.seek(0)
+            self.__csv_buffer.truncate()
+            return line
+
+        return '\t'.join([_format_text_value(v) for v in values]) + '\n'
+
+    def read(self, size=-1):
+        lines = [self.__buffer]
+        length = len(self.__buffer)
+        while not self.__exhausted and (size < 0 or length < size):
+            try:
+                row = next(self.__rows)
+            except StopIteration:
+                self.__exhausted = True
+                break
+
+            line = self._encode_row(row)
+            lines.append(line)
+            length += len(line)
+            self.row_count += 1
+
+        data = ''.join(lines)
+        if 0 <= size < len(data):
+            data, self.__buffer = data[:size], data[size:]
+        else:
+            self.__buffer = ''
+        return data
+
+    def readline(self, size=-1):
+        return self.read(size)
@@ -31,3 +31,42 @@ class DBExecMode(BaseEnum):
     UPDATE = 'Update'
     BATCH_UPDATE = 'Batch Update'
     DELETE = 'Delete'
+
+
+@unique
+class PaginateMode(BaseEnum):
+    # 窗口函数在同一条语句中返回总行数
+    EXACT = 'Exact'
+    # 多取一行判断是否存在下一页, 不统计总数
+    HAS_MORE = 'HasMore'
+    # 使用执行计划的估算行数作为总数
+    ESTIMATE = 'Estimate'
+
+
+@unique
+class RowFormat(BaseEnum):
+    # RealDictRow, 每行一个字典
+    DICT = 'Dict'
+    # 元组, 所有行共享列索引
+    TUPLE = 'Tuple'
+    # __slots__ 行对象
+    SLOTS = 'Slots'
+
+
+@unique
+class PartitionInterval(BaseEnum):
+    # 每个分区覆盖的时间范围
+    DAY = 'day'
+    WEEK = 'week'
+    MONTH = 'month'
+    YEAR = 'year'
+
+
+@unique
+class BufferOverflowPolicy(BaseEnum):
+    # 队列满时最多等待 block_timeout 秒, 仍然满则丢弃
+    BLOCK = 'Block'
+    # 队列满时直接丢弃新记录
+    DROP = 'Drop'
+    # 队列满时在调用线程同步写入
+    SYNC = 'Sync'
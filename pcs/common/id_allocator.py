@@ -0,0 +1,74 @@
+from collections import deque
+import threading
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 每次从序列预留的默认主键数量
+DEFAULT_ID_BLOCK_SIZE = 1000
+
+
+class IdAllocator:
+    """按 (数据库, 序列) 一次从序列预留一批主键, 在进程内分配
+
+    预留由调用方提供的 reserve(count) 完成, 返回从序列取出的主键列表.
+    未使用的主键在进程退出时丢弃, 多个进程各自持有一批, 因此主键只保证唯一, 不保证按写入顺序递增
+    """
+
+    def __init__(self, block_size=DEFAULT_ID_BLOCK_SIZE):
+        self.block_size = block_size
+        self.__blocks = {}
+        self.__locks = {}
+        self.__lock = threading.Lock()
+
+    def __get_lock(self, key):
+        lock = self.__locks.get(key)
+        if lock is None:
+            with self.__lock:
+                lock = self.__locks.setdefault(key, threading.Lock())
+        return lock
+
+    def allocate(self, key, count, reserve, block_size=None):
+        """取出 count 个主键, 本地不足时调用 reserve 预留 max(不足数量, block_size) 个"""
+        if count <= 0:
+            return []
+
+        block_size = block_size or self.block_size
+        with self.__get_lock(key):
+            block = self.__blocks.get(key)
+            if block is None:
+                block = self.__blocks[key] = deque()
+
+            shortage = count - len(block)
+            if shortage > 0:
+                block.extend(reserve(max(shortage, block_size)))
+                logger.debug("序列%s预留主键, 本地剩余%d个" % (str(key), len(block)))
+
+            popleft = block.popleft
+            return [popleft() for _ in range(count)]
+
+    def clear(self, key=None):
+        """丢弃本地预留的主键, 序列被重置后需要调用"""
+        with self.__lock:
+            if key is None:
+                self.__blocks.clear()
+            else:
+                self.__blocks.pop(key, None)
+
+    def remaining(self, key):
+        block = self.__blocks.get(key)
+        return len(block) if block else 0
+
+
+    def _after_fork(self):
+        """fork 出的子进程不能继续使用父进程预留的主键, 否则父子进程会分配相同的主键"""
+        self.__blocks = {}
+        self.__locks = {}
+        self.__lock = threading.Lock()
+
+
+id_allocator = IdAllocator()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=id_allocator._after_fork)
@@ -0,0 +1,21 @@
+from psycopg2 import extras
+import json
+
+JSON_COLUMN_TYPES = ('json', 'jsonb')
+
+# 紧凑输出并关闭循环引用检查, 比默认的 json.dumps 更快
+_json_encoder = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False, check_circular=False)
+
+
+def json_dumps(value):
+    return _json_encoder.encode(value)
+
+
+def adapt_json(value):
+    """
+    JSON字段的值由 psycopg2 在执行时序列化一次;
+    str/bytes 视为调用方已序列化的 JSON 文本, 原样交给数据库解析
+    """
+    if value is None or isinstance(value, (str, bytes, bytearray)):
+        return value
+    return extras.Json(value, dumps=json_dumps)
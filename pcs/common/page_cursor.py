@@ -0,0 +1,56 @@
+from pcs.common.errors import InvalidScError
+from decimal import Decimal
+import datetime
+import base64
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 游标中保留类型信息的标记, 保证解码后的值与数据库中的排序键类型一致
+CURSOR_TYPE_DATETIME = "$dt"
+CURSOR_TYPE_DATE = "$d"
+CURSOR_TYPE_DECIMAL = "$n"
+
+
+def _encode_value(value):
+    if isinstance(value, datetime.datetime):
+        return {CURSOR_TYPE_DATETIME: value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {CURSOR_TYPE_DATE: value.isoformat()}
+    if isinstance(value, Decimal):
+        return {CURSOR_TYPE_DECIMAL: str(value)}
+    return value
+
+
+def _decode_value(value):
+    if not isinstance(value, dict):
+        return value
+    if CURSOR_TYPE_DATETIME in value:
+        return datetime.datetime.fromisoformat(value[CURSOR_TYPE_DATETIME])
+    if CURSOR_TYPE_DATE in value:
+        return datetime.date.fromisoformat(value[CURSOR_TYPE_DATE])
+    if CURSOR_TYPE_DECIMAL in value:
+        return Decimal(value[CURSOR_TYPE_DECIMAL])
+    raise ValueError("未知的游标值 %s" % value)
+
+
+def encode_cursor(key_values):
+    """将最后一行的排序键值编码为不透明的游标字符串"""
+    data = json.dumps([_encode_value(v) for v in key_values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor, key_count):
+    """解码游标, 返回排序键值列表, 游标非法时抛出 InvalidScError"""
+    try:
+        data = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        key_values = [_decode_value(v) for v in json.loads(data)]
+    except Exception as e:
+        logger.warning("解析分页游标失败: %s" % str(e))
+        raise InvalidScError("非法的分页游标'{0}'".format(cursor))
+
+    if len(key_values) != key_count:
+        raise InvalidScError("分页游标与排序键数量不一致'{0}'".format(cursor))
+
+    return key_values
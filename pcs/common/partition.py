@@ -0,0 +1,72 @@
+from pcs.common.enum.system_enum import PartitionInterval
+import datetime
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+PARTITION_RELKIND_SQL = "select c.relkind from pg_class c where c.oid = to_regclass(%s)"
+
+PARTITION_LIST_SQL = """
+    select c.relname as partition_name, pg_get_expr(c.relpartbound, c.oid) as partition_bound
+      from pg_inherits i
+      join pg_class c on c.oid = i.inhrelid
+     where i.inhparent = to_regclass(%s)
+     order by c.relname
+"""
+
+# pg_class.relkind 中分区表的类型
+PARTITIONED_RELKIND = 'p'
+
+_RANGE_BOUND_PATTERN = re.compile(r"FOR VALUES FROM \((.+)\) TO \((.+)\)", re.IGNORECASE)
+
+
+def partition_start(value, interval):
+    """value 所在分区的开始时间"""
+    value = datetime.datetime(value.year, value.month, value.day)
+    if interval == PartitionInterval.DAY.value:
+        return value
+    if interval == PartitionInterval.WEEK.value:
+        return value - datetime.timedelta(days=value.weekday())
+    if interval == PartitionInterval.MONTH.value:
+        return value.replace(day=1)
+    if interval == PartitionInterval.YEAR.value:
+        return value.replace(month=1, day=1)
+    raise ValueError("不支持的分区间隔'{0}'".format(interval))
+
+
+def next_partition_start(start, interval):
+    """start 所在分区的下一个分区的开始时间"""
+    if interval == PartitionInterval.DAY.value:
+        return start + datetime.timedelta(days=1)
+    if interval == PartitionInterval.WEEK.value:
+        return start + datetime.timedelta(days=7)
+    if interval == PartitionInterval.MONTH.value:
+        return start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+    if interval == PartitionInterval.YEAR.value:
+        return start.replace(year=start.year + 1)
+    raise ValueError("不支持的分区间隔'{0}'".format(interval))
+
+
+def partition_name(table_name, start):
+    return "{0}_p{1}".format(table_name, start.strftime('%Y%m%d'))
+
+
+def _parse_bound_value(value):
+    """MINVALUE/MAXVALUE 返回 None, 带时区的时间转换为本地时间"""
+    value = value.strip()
+    if not value.startswith("'"):
+        return None
+
+    value = datetime.datetime.fromisoformat(value.strip("'"))
+    if value.tzinfo is not None:
+        value = value.astimezone().replace(tzinfo=None)
+    return value
+
+
+def parse_range_bound(bound):
+    """解析 pg_get_expr(relpartbound) 的范围分区边界, 返回 (下界, 上界), DEFAULT 分区返回 None"""
+    match = _RANGE_BOUND_PATTERN.search(bound or '')
+    if not match:
+        return None
+    return _parse_bound_value(match.group(1)), _parse_bound_value(match.group(2))
@@ -1,10 +1,34 @@
 from pcs.common.enum.system_enum import ResponseState
-from flask import jsonify
+from pcs.common.row_format import SlotsRow
+from flask import jsonify, stream_with_context, Response as FlaskResponse
+from decimal import Decimal
+import datetime
+import uuid
+import json
+import csv
+import io
 import logging
 
 
 logger = logging.getLogger(__name__)
 
+# 流式响应每累计多少行输出一次
+STREAM_FLUSH_ROWS = 500
+
+
+def json_default(value):
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, memoryview):
+        return value.hex()
+    if isinstance(value, SlotsRow):
+        return value.to_dict()
+    raise TypeError("无法序列化的类型 %s" % type(value).__name__)
+
 
 class Response(object):
 
@@ -21,11 +45,13 @@ class Response(object):
         return jsonify(code=ResponseState.SUCCESS.value, msg=msg, data=None)
 
     @staticmethod
-    def pagination(page_data, page_index, page_count=None):
+    def pagination(page_data, page_index, page_count=None, next_cursor=None, row_count=None):
         data = {
             "page_index": page_index,
             "page_data": page_data,
-            "page_count": page_count if page_count else len(page_data)
+            "page_count": page_count if page_count else len(page_data),
+            "next_cursor": next_cursor,
+            "row_count": row_count,
         }
         return jsonify(code=ResponseState.SUCCESS.value, msg="", data=data)
 
@@ -35,4 +61,70 @@ class Response(object):
 
     @staticmethod
     def html_data(json_data):
-        return jsonify(code=ResponseState.SUCCESS.value, msg="", data=json_data)
\ No newline at end of file
+        return jsonify(code=ResponseState.SUCCESS.value, msg="", data=json_data)
+
+    @staticmethod
+    def stream_ndjson(rows, flush_rows=STREAM_FLUSH_ROWS, resource=None, filename=None):
+        """
+        逐行输出 NDJSON, 适用于 BaseTable.iter_query 返回的生成器, 内存占用与行数无关
+        :param resource: 流结束后需要关闭的对象(如 controller), 在此之前保持其引用, 防止连接提前归还连接池
+        """
+        def generate():
+            lines = []
+            for row in rows:
+                lines.append(json.dumps(row, default=json_default, ensure_ascii=False))
+                if len(lines) >= flush_rows:
+                    yield '\n'.join(lines) + '\n'
+                    lines = []
+
+            if lines:
+                yield '\n'.join(lines) + '\n'
+
+        return Response._stream(generate(), 'application/x-ndjson', resource=resource, filename=filename)
+
+    @staticmethod
+    def stream_csv(rows, fields=None, flush_rows=STREAM_FLUSH_ROWS, resource=None, filename=None):
+        """
+        逐行输出 CSV, 第一行为表头
+        :param fields: 表头, 字典行(及 SLOTS 行)按这些键取值, 默认使用第一行的键;
+                       元组行没有列名, 必须指定 fields, 按位置原样输出
+        :param resource: 同 stream_ndjson
+        """
+        def generate():
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            header = list(fields) if fields else None
+            by_name = True
+            row_count = 0
+            for row in rows:
+                if not row_count:
+                    by_name = hasattr(row, 'keys')
+                    if header is None:
+                        if not by_name:
+                            raise ValueError("元组行没有列名, 需要通过 fields 指定表头")
+                        header = list(row.keys())
+                    writer.writerow(header)
+
+                writer.writerow([row.get(f) for f in header] if by_name else row)
+                row_count += 1
+                if row_count % flush_rows == 0:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+
+            if not row_count and header:
+                writer.writerow(header)
+
+            if buffer.tell():
+                yield buffer.getvalue()
+
+        return Response._stream(generate(), 'text/csv', resource=resource, filename=filename)
+
+    @staticmethod
+    def _stream(chunks, mimetype, resource=None, filename=None):
+        response = FlaskResponse(stream_with_context(chunks), mimetype=mimetype)
+        if filename:
+            response.headers["Content-Disposition"] = 'attachment; filename="{0}"'.format(filename)
+        if resource is not None:
+            response.call_on_close(resource.close)
+        return response
@@ -0,0 +1,129 @@
+from pcs.common.enum.system_enum import RowFormat
+import threading
+import keyword
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class TupleRows(list):
+    """元组行的列表, 所有行共享同一份列名和列索引"""
+
+    def __init__(self, columns, rows=()):
+        super(TupleRows, self).__init__(rows)
+        self.columns = tuple(columns)
+        self.index = {column: i for i, column in enumerate(self.columns)}
+
+    def column(self, name):
+        i = self.index[name]
+        return [row[i] for row in self]
+
+    def to_dicts(self):
+        return [dict(zip(self.columns, row)) for row in self]
+
+
+class SlotsRow:
+    """使用 __slots__ 保存字段值的行, 支持按列名, 下标和属性读取
+
+    具体的行类由 get_row_class 按列名生成并缓存
+    """
+    __slots__ = ()
+    _fields = ()
+    _slot_names = ()
+    _slot_map = {}
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            return getattr(self, self._slot_names[key])
+        return getattr(self, self._slot_map[key])
+
+    def get(self, key, default=None):
+        slot_name = self._slot_map.get(key)
+        if slot_name is None:
+            return default
+        return getattr(self, slot_name)
+
+    def keys(self):
+        return self._fields
+
+    def values(self):
+        return tuple(getattr(self, name) for name in self._slot_names)
+
+    def items(self):
+        return tuple(zip(self._fields, self.values()))
+
+    def to_dict(self):
+        return dict(self.items())
+
+    def __contains__(self, key):
+        return key in self._slot_map
+
+    def __iter__(self):
+        return iter(self._fields)
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __eq__(self, other):
+        if isinstance(other, SlotsRow):
+            return self.items() == other.items()
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    def __repr__(self):
+        return "Row(%s)" % ", ".join("%s=%r" % item for item in self.items())
+
+
+_row_classes = {}
+_row_classes_lock = threading.Lock()
+
+
+def get_row_class(columns):
+    """按列名生成 SlotsRow 子类, 非法或重复的列名使用 _f{下标} 作为槽名"""
+    columns = tuple(columns)
+    row_class = _row_classes.get(columns)
+    if row_class is not None:
+        return row_class
+
+    slot_names = []
+    for i, column in enumerate(columns):
+        valid = (
+            column.isidentifier() and not keyword.iskeyword(column) and not column.startswith('_')
+            and not hasattr(SlotsRow, column) and column not in slot_names
+        )
+        slot_names.append(column if valid else '_f%d' % i)
+
+    row_class = type('Row', (SlotsRow,), {
+        '__slots__': tuple(slot_names),
+        '_fields': columns,
+        '_slot_names': tuple(slot_names),
+        '_slot_map': {column: slot_name for column, slot_name in zip(reversed(columns), reversed(slot_names))},
+    })
+    row_class._setters = tuple(getattr(row_class, name).__set__ for name in slot_names)
+
+    with _row_classes_lock:
+        return _row_classes.setdefault(columns, row_class)
+
+
+def make_slots_rows(columns, rows):
+    row_class = get_row_class(columns)
+    setters = row_class._setters
+    new_row = object.__new__
+
+    result = []
+    for values in rows:
+        row = new_row(row_class)
+        for setter, value in zip(setters, values):
+            setter(row, value)
+        result.append(row)
+    return result
+
+
+def convert_rows(columns, rows, row_format):
+    """把游标返回的元组行转换为指定的行格式"""
+    if row_format == RowFormat.TUPLE.value:
+        return TupleRows(columns, rows)
+    if row_format == RowFormat.SLOTS.value:
+        return make_slots_rows(columns, rows)
+    return [dict(zip(columns, row)) for row in rows]
@@ -15,9 +15,25 @@ PAGE_SIZE = "page_size"
 QUERY_CONDITION = 'query_condition'
 ORDER_BY = "order_by"
 GROUP_BY = "group_by"
+PAGE_ROW_COUNT_FIELD = "__row_count"
+COPY_BUFFER_SIZE = 65536
+STAGE_ROW_NO_FIELD = "pcs_row_no"
 
 SAVE_FLAG = 'save_flag'
+# 只在创建时写入的审计字段
+CREATE_LOG_FIELDS = ('create_date', 'create_uid')
+# 每次更新时写入的审计字段
+WRITE_LOG_FIELDS = ('write_date', 'write_uid')
 
 SQL_TYPE_MAP = {
     "int": "INTEGER", "float": "NUMERIC", "bool": "BOOLEAN", "datetime": "TIMESTAMP", "date": "DATE", "json": "JSON",
-}
\ No newline at end of file
+}
+
+SQL_AGGREGATE_FUNCS = {
+    "count": "count({0})", "sum": "sum({0})", "min": "min({0})", "max": "max({0})", "avg": "avg({0})",
+    "count_distinct": "count(distinct {0})",
+}
+# 可用于裁剪范围分区的比较操作符
+SQL_PARTITION_PRUNE_OPERATES = ('=', '>', '>=', '<', '<=')
+SQL_HAVING_OPERATE_VALUES = ['=', '!=', '>', '>=', '<', '<=']
+SQL_DATE_TRUNC_UNITS = ['minute', 'hour', 'day', 'week', 'month', 'quarter', 'year']
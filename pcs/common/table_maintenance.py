@@ -0,0 +1,72 @@
+from pcs.common.errors import DBError
+from psycopg2.extras import RealDictCursor
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 清理过期数据的默认参数
+PURGE_BATCH_SIZE = 5000
+PURGE_SLEEP = 0.1
+
+
+def get_retention_tables(app, table_names=None):
+    """返回设置了保留期限的Table类, table_names 为Table类名列表, 为空时返回全部"""
+    return [
+        table_class for name, table_class in app.tables.tables.items()
+        if table_class.retention_field and table_class.retention_days
+        and (not table_names or name in table_names)
+    ]
+
+
+def get_partition_tables(app, table_names=None):
+    """返回声明了分区字段的Table类"""
+    return [
+        table_class for name, table_class in app.tables.tables.items()
+        if table_class.partition_field and (not table_names or name in table_names)
+    ]
+
+
+def _run_for_tables(app, table_classes, action, description):
+    """每个表使用独立的自动提交连接执行 action(table_obj), 单个表失败不影响其他表"""
+    results = []
+    for table_class in table_classes:
+        conn = app.get_db_connect(table_class.db_name, autocommit=True)
+        if not conn:
+            logger.error("%s[%s]失败: 未连接数据库[%s]" % (description, table_class.table_name, table_class.db_name))
+            results.append({"table": table_class.table_name, "error": "未连接数据库"})
+            continue
+
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        try:
+            table_obj = app.get_table_obj(table_class.__name__, cur)
+            results.append(action(table_obj))
+        except DBError as e:
+            logger.error("%s[%s]失败: %s" % (description, table_class.table_name, str(e)))
+            results.append({"table": table_class.table_name, "error": str(e)})
+        finally:
+            cur.close()
+            conn.close()
+
+    return results
+
+
+def purge_expired_tables(app, table_names=None, batch_size=PURGE_BATCH_SIZE, sleep=PURGE_SLEEP, max_batches=None):
+    """
+    逐个表清理过期数据, 每批删除单独提交, 分区表先删除整个过期的分区
+    :param app: 已初始化的 BaseFlaskApp
+    :return: 每个表的清理结果列表, 失败的表包含 error
+    """
+    return _run_for_tables(
+        app, get_retention_tables(app, table_names),
+        lambda table_obj: table_obj.purge_expired(batch_size=batch_size, sleep=sleep, max_batches=max_batches),
+        "清理表",
+    )
+
+
+def ensure_partitions_tables(app, table_names=None):
+    """为声明了分区字段的表创建当前和之后的分区, 返回 [{"table", "created"}]"""
+    return _run_for_tables(
+        app, get_partition_tables(app, table_names),
+        lambda table_obj: {"table": table_obj.table_name, "created": table_obj.ensure_partitions()},
+        "创建分区",
+    )
@@ -1,10 +1,30 @@
 from celery import Celery
+from celery.schedules import crontab
+import os
 
-broker_url = 'redis://192.168.3.99:6379/0'
-backend = 'redis://192.168.3.99:6379/0'
-pcs_celery_app = Celery('pcs_celery', broker=broker_url, backend=backend, include=['celery_demo.tasks'])
+broker_url = os.environ.get('PCS_CELERY_BROKER_URL', 'redis://192.168.3.99:6379/0')
+backend = os.environ.get('PCS_CELERY_BACKEND', broker_url)
+pcs_celery_app = Celery('pcs_celery', broker=broker_url, backend=backend,
+                        include=['pcs.extensions.celery_extension.tasks'])
 
 pcs_celery_app.conf.update(
     result_expires=3600,
+    # 为 true 时任务在投递的进程中同步执行, 用于测试
+    task_always_eager=os.environ.get('PCS_CELERY_ALWAYS_EAGER', '').lower() == 'true',
+    # 任务执行完成后才确认, worker 异常退出时任务块会重新投递, 由幂等键避免重复写入
+    task_acks_late=True,
+    beat_schedule={
+        # 每天凌晨清理超过保留期限的数据
+        'purge-expired-tables': {
+            'task': 'pcs.purge_expired_tables',
+            'schedule': crontab(
+                hour=os.environ.get('PCS_PURGE_HOUR', '3'), minute=os.environ.get('PCS_PURGE_MINUTE', '0'),
+            ),
+        },
+        # 提前创建分区表之后的分区
+        'ensure-partitions': {
+            'task': 'pcs.ensure_partitions',
+            'schedule': crontab(hour=os.environ.get('PCS_PARTITION_HOUR', '2'), minute='0'),
+        },
+    },
 )
-
@@ -0,0 +1,43 @@
+from pcs.extensions.celery_extension.tasks import batch_create_task, batch_write_task, batch_delete_task
+import uuid
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 每个任务处理的默认行数
+TASK_CHUNK_SIZE = 5000
+
+
+def _enqueue_chunks(task, table_name, items, chunk_size, idempotency_key, options):
+    """
+    按 chunk_size 拆分为多个任务投递, 每块的幂等键为 {idempotency_key}:{块序号};
+    同一个 idempotency_key 重复投递时, 已执行成功的块不会重复执行
+    :return: 任务id列表
+    """
+    idempotency_key = idempotency_key or uuid.uuid4().hex
+    task_ids = []
+    items = list(items)
+    for index, start in enumerate(range(0, len(items), chunk_size)):
+        result = task.apply_async(
+            args=(table_name, items[start:start + chunk_size]),
+            kwargs=dict(options, idempotency_key="%s:%d" % (idempotency_key, index)),
+        )
+        task_ids.append(result.id)
+
+    logger.info("投递%s任务: 表[%s], %d行, %d个任务" % (task.name, table_name, len(items), len(task_ids)))
+    return task_ids
+
+
+def enqueue_batch_create(table_name, rows, chunk_size=TASK_CHUNK_SIZE, idempotency_key=None, **options):
+    """投递批量创建任务, options 传给 batch_create_task, 如 page_size, use_copy"""
+    return _enqueue_chunks(batch_create_task, table_name, rows, chunk_size, idempotency_key, options)
+
+
+def enqueue_batch_write(table_name, rows, chunk_size=TASK_CHUNK_SIZE, idempotency_key=None, **options):
+    """投递批量更新任务, options 传给 batch_write_task, 如 condition_keys, field_type, skip_unchanged"""
+    return _enqueue_chunks(batch_write_task, table_name, rows, chunk_size, idempotency_key, options)
+
+
+def enqueue_batch_delete(table_name, keys, chunk_size=TASK_CHUNK_SIZE, idempotency_key=None, **options):
+    """投递按主键批量删除任务, options 传给 batch_delete_task, 如 key_field"""
+    return _enqueue_chunks(batch_delete_task, table_name, keys, chunk_size, idempotency_key, options)
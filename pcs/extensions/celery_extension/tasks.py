@@ -0,0 +1,188 @@
+from pcs.extensions.celery_extension import pcs_celery_app
+from pcs.common.table_maintenance import purge_expired_tables, ensure_partitions_tables, PURGE_BATCH_SIZE, \
+    PURGE_SLEEP
+from pcs.common.errors import DBError
+from psycopg2.extras import RealDictCursor, Json
+from psycopg2 import Error as PgError
+from flask import current_app, has_app_context
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+_flask_app = None
+_flask_app_lock = threading.Lock()
+# 已创建幂等记录表的数据库
+_idempotency_dbs = set()
+
+
+# 记录已执行任务块的表, 与写入的数据在同一个事务中提交
+IDEMPOTENCY_TABLE = 'pcs_task_idempotency'
+# 已执行任务块的记录保留天数, 由清理过期数据的任务删除
+IDEMPOTENCY_KEEP_DAYS = 7
+
+IDEMPOTENCY_TABLE_SQL = """
+    create table if not exists {0} (
+        idempotency_key varchar primary key,
+        result jsonb,
+        create_date timestamp not null default now()
+    )
+""".format(IDEMPOTENCY_TABLE)
+IDEMPOTENCY_CLAIM_SQL = "insert into {0} (idempotency_key) values (%s) on conflict do nothing".format(
+    IDEMPOTENCY_TABLE)
+IDEMPOTENCY_RESULT_SQL = "select result from {0} where idempotency_key = %s".format(IDEMPOTENCY_TABLE)
+IDEMPOTENCY_SAVE_SQL = "update {0} set result = %s where idempotency_key = %s".format(IDEMPOTENCY_TABLE)
+IDEMPOTENCY_EXISTS_SQL = "select to_regclass(%s)"
+IDEMPOTENCY_PURGE_SQL = "delete from {0} where create_date < now() - %s * interval '1 day'".format(
+    IDEMPOTENCY_TABLE)
+
+# 单个任务块失败后的重试次数和间隔(秒)
+BATCH_TASK_MAX_RETRIES = 3
+BATCH_TASK_RETRY_DELAY = 5
+
+
+def get_flask_app():
+    """
+    worker 进程中按需创建一次 Flask 应用, 复用其中的连接池和Table注册信息;
+    在 Flask 应用上下文中同步执行(task_always_eager)时使用当前应用
+    """
+    global _flask_app
+    if has_app_context():
+        return current_app._get_current_object()
+
+    if _flask_app is None:
+        with _flask_app_lock:
+            if _flask_app is None:
+                from pcs.app import create_app
+                _flask_app = create_app(args=[])
+    return _flask_app
+
+
+@pcs_celery_app.task(name='pcs.purge_expired_tables')
+def purge_expired_tables_task(table_names=None, batch_size=PURGE_BATCH_SIZE, sleep=PURGE_SLEEP, max_batches=None):
+    app = get_flask_app()
+    with app.app_context():
+        result = purge_expired_tables(app, table_names=table_names, batch_size=batch_size, sleep=sleep,
+                                      max_batches=max_batches)
+        if not table_names:
+            _purge_idempotency_keys(app)
+        return result
+
+
+@pcs_celery_app.task(name='pcs.ensure_partitions')
+def ensure_partitions_task(table_names=None):
+    app = get_flask_app()
+    with app.app_context():
+        return ensure_partitions_tables(app, table_names=table_names)
+
+
+def _ensure_idempotency_table(app, db_name):
+    """每个进程对每个数据库创建一次幂等记录表, 使用单独的自动提交连接"""
+    if db_name in _idempotency_dbs:
+        return
+
+    conn = app.get_db_connect(db_name, autocommit=True)
+    cur = conn.cursor()
+    try:
+        cur.execute(IDEMPOTENCY_TABLE_SQL)
+    except PgError as e:
+        # 多个 worker 同时创建时, 后创建的可能违反系统表的唯一约束
+        logger.warning("创建幂等记录表失败: %s" % str(e))
+    finally:
+        cur.close()
+        conn.close()
+    _idempotency_dbs.add(db_name)
+
+
+def _purge_idempotency_keys(app):
+    """清理所有已连接的 postgresql 数据库中过期的幂等记录, 未创建记录表的数据库跳过"""
+    for db_name, conf in app.dbs_conf.items():
+        if conf.get("db_type") != "postgresql" or not app.db_pool.exists_pool(db_name):
+            continue
+
+        conn = app.get_db_connect(db_name, autocommit=True)
+        cur = conn.cursor()
+        try:
+            cur.execute(IDEMPOTENCY_EXISTS_SQL, (IDEMPOTENCY_TABLE,))
+            if cur.fetchone()[0] is None:
+                continue
+            cur.execute(IDEMPOTENCY_PURGE_SQL, (IDEMPOTENCY_KEEP_DAYS,))
+        except PgError as e:
+            logger.error("清理幂等记录失败: %s" % str(e))
+        finally:
+            cur.close()
+            conn.close()
+
+
+def _run_chunk(task, table_name, idempotency_key, action):
+    """
+    在一个事务中对一块数据执行 action(table_obj), 数据库异常时回滚并重试;
+    idempotency_key 在同一事务中先插入幂等记录表再写入, 记录已存在时说明该块已提交,
+    直接返回上次的结果. 同时投递的相同块会在插入记录时等待先执行的事务结束
+    """
+    app = get_flask_app()
+    table_class = app.tables.tables.get(table_name)
+    if table_class is None:
+        raise ValueError("不存在此Table %s" % table_name)
+
+    if idempotency_key:
+        _ensure_idempotency_table(app, table_class.db_name)
+
+    conn = app.get_db_connect(table_class.db_name, autocommit=False)
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        if idempotency_key:
+            cur.execute(IDEMPOTENCY_CLAIM_SQL, (idempotency_key,))
+            if not cur.rowcount:
+                cur.execute(IDEMPOTENCY_RESULT_SQL, (idempotency_key,))
+                row = cur.fetchone()
+                conn.rollback()
+                logger.info("任务块[%s]已执行, 跳过" % idempotency_key)
+                return row["result"] if row else None
+
+        table_obj = app.get_table_obj(table_name, cur)
+        result = action(table_obj)
+        if idempotency_key:
+            cur.execute(IDEMPOTENCY_SAVE_SQL, (Json(result), idempotency_key))
+        conn.commit()
+    except DBError as e:
+        conn.rollback()
+        logger.warning("任务块[%s]执行失败, 第%d次重试: %s" % (idempotency_key, task.request.retries + 1, str(e)))
+        raise task.retry(exc=e)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        conn.close()
+
+    return result
+
+
+@pcs_celery_app.task(bind=True, name='pcs.batch_create', max_retries=BATCH_TASK_MAX_RETRIES,
+                     default_retry_delay=BATCH_TASK_RETRY_DELAY)
+def batch_create_task(self, table_name, rows, idempotency_key=None, page_size=1000, use_copy=False):
+    """写入一块数据, 返回写入行的主键列表"""
+    return _run_chunk(self, table_name, idempotency_key, lambda table_obj: table_obj.batch_create(
+        rows, page_size=page_size, use_copy=use_copy, return_ids=True
+    ))
+
+
+@pcs_celery_app.task(bind=True, name='pcs.batch_write', max_retries=BATCH_TASK_MAX_RETRIES,
+                     default_retry_delay=BATCH_TASK_RETRY_DELAY)
+def batch_write_task(self, table_name, rows, idempotency_key=None, condition_keys=None, field_type=None,
+                     skip_unchanged=False, staged=False, page_size=1000):
+    """更新一块数据, 返回更新的行数, skip_unchanged 时返回 [变化行数, 未变化行数]"""
+    return _run_chunk(self, table_name, idempotency_key, lambda table_obj: table_obj.batch_write(
+        rows, condition_keys=condition_keys, field_type=field_type, skip_unchanged=skip_unchanged, staged=staged,
+        page_size=page_size,
+    ))
+
+
+@pcs_celery_app.task(bind=True, name='pcs.batch_delete', max_retries=BATCH_TASK_MAX_RETRIES,
+                     default_retry_delay=BATCH_TASK_RETRY_DELAY)
+def batch_delete_task(self, table_name, keys, idempotency_key=None, key_field=None, chunk_size=1000):
+    """按主键删除一块数据, 返回删除的行数"""
+    return _run_chunk(self, table_name, idempotency_key, lambda table_obj: table_obj.batch_delete(
+        keys=keys, key_field=key_field, chunk_size=chunk_size,
+    ))
@@ -1,7 +1,18 @@
-from threading import Condition
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+from threading import Condition, Event, Thread
+import heapq
+import logging
+import math
+import random
+import time
+import weakref
 
 from .steady_db import connect
 
+logger = logging.getLogger(__name__)
+
 
 class PooledDBError(Exception):
     """常规池数据库错误."""
@@ -19,6 +30,16 @@ class TooManyConnections(PooledDBError):
     """打开的数据库连接过多."""
 
 
+class CheckoutTimeout(TooManyConnections):
+    """等待可用连接超时."""
+
+
+# 取连接等待时间直方图的桶上限(秒), 最后一个桶统计超过所有上限的等待
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30)
+# 自适应时窗口内需要等待的取连接超过此比例(即 p95 等待时间大于 0)视为连接不足
+ADAPTIVE_WAIT_RATIO = 0.05
+
+
 class PooledDB:
     """用于 DB连接的池。
 
@@ -29,7 +50,11 @@ class PooledDB:
             self, creator, mincached=0, maxcached=0,
             maxshared=0, maxconnections=0, blocking=False,
             maxusage=None, setsession=None, reset=True,
-            failures=None, ping=1,
+            failures=None, ping=1, checkout_timeout=None,
+            idle_timeout=None, max_lifetime=None, lifetime_jitter=0.1,
+            health_check_interval=None, health_check_sql="select 1", maintenance_interval=None,
+            adaptive=False, adaptive_max=None, adaptive_window=300, adaptive_headroom=0.2,
+            adaptive_hysteresis=0.2, warmup_parallelism=4, warmup_deferred=False,
             *args, **kwargs):
         """ creator: 返回新 DB的任意函数连接对象或符合 DB的数据库模块
             mincached:池中空闲连接的初始数（0 表示启动时不建立连接）
@@ -47,6 +72,21 @@ class PooledDB:
                 2 = 每当创建游标时，
                 4 = 执行查询时，
                 7 = 总是，以及这些值的所有其他位组合）
+            checkout_timeout:blocking 为 true 时等待可用连接的最长秒数，超时抛出 CheckoutTimeout（0 或 None 表示一直等待）
+            idle_timeout:空闲超过此秒数的连接由后台线程关闭，保留 mincached 个（0 或 None 表示不关闭）
+            max_lifetime:连接建立超过此秒数后关闭并重新建立（0 或 None 表示不限制）
+            lifetime_jitter:max_lifetime 随机提前的比例，避免同时建立的连接同时重建
+            health_check_interval:后台线程检查空闲连接的间隔秒数，此间隔内检查过的连接取出时不再 ping（0 或 None 表示不检查）
+            health_check_sql:后台检查连接执行的 SQL
+            maintenance_interval:后台线程的运行间隔秒数（None 表示按以上时间自动计算）
+            adaptive:是否按最近的需求调整保持的连接数，在 mincached 和 adaptive_max 之间由后台线程调整
+            adaptive_max:保持的连接数上限（None 表示 maxconnections，未设置时为 maxcached，都未设置时为 mincached 的 4 倍）
+            adaptive_window:统计需求的滑动窗口秒数，窗口内的最大并发（使用中加排队的连接数）作为需求，
+                窗口内超过 5% 的取连接需要等待时在需求之上再扩大
+            adaptive_headroom:在需求之上多保持的比例
+            adaptive_hysteresis:需求比当前保持数少这个比例以上才缩小，且每个窗口最多缩小一次，避免来回调整
+            warmup_parallelism:建立初始连接和后台补充连接时同时建立的连接数
+            warmup_deferred:是否在后台线程建立初始连接，创建连接池时不等待（建立失败只记录日志）
             args，kwargs：应传递给创建者的参数,DB模块的函数或连接构造函数
         """
         try:
@@ -72,8 +112,15 @@ class PooledDB:
         self._reset = reset
         self._failures = failures
         self._ping = ping
+        self._checkout_timeout = checkout_timeout
+        self._idle_timeout = idle_timeout
+        self._max_lifetime = max_lifetime
+        self._lifetime_jitter = lifetime_jitter or 0
+        self._health_check_interval = health_check_interval
+        self._health_check_sql = health_check_sql
         if mincached is None:
             mincached = 0
+        self._mincached = mincached
         if maxcached is None:
             maxcached = 0
         if maxconnections is None:
@@ -86,7 +133,11 @@ class PooledDB:
             self._maxcached = 0
         if threadsafety > 1 and maxshared:
             self._maxshared = maxshared
-            self._shared_cache = []  # 共享连接的缓存
+            self._shared_cache = {}  # 共享连接的缓存 {id(共享连接): 共享连接}
+            # 共享连接的最小堆, 条目为 (是否在事务中, 共享数, 序号, 版本, 共享连接),
+            # 共享数变化时压入新条目, 旧条目在弹出时按版本丢弃
+            self._shared_heap = []
+            self._shared_seq = count()
         else:
             self._maxshared = 0
         if maxconnections:
@@ -97,19 +148,80 @@ class PooledDB:
             self._maxconnections = maxconnections
         else:
             self._maxconnections = 0
-        self._idle_cache = []  # 空闲连接的实际池
+        # 空闲连接的实际池, 从右端取出和放回, 优先复用最近使用的连接
+        self._idle_cache = deque()
         self._lock = Condition()
+        # 按到达顺序排队的等待者, 每个等待者是与池共用同一把锁的 Condition, 只唤醒队首
+        self._waiters = deque()
         self._connections = 0
+        # 取连接的统计
+        self._checkouts = 0
+        self._waits = 0
+        self._timeouts = 0
+        self._wait_time = 0.0
+        self._max_waiting = 0
+        self._wait_histogram = [0] * (len(WAIT_BUCKETS) + 1)
+        # 后台维护的统计
+        self._reaped = 0
+        self._recycled = 0
+        self._health_failures = 0
+        # 保持的连接数(使用中加空闲), 自适应时由后台线程在 mincached 和 adaptive_max 之间调整
+        self._warm = mincached
+        self._adaptive = adaptive
+        if adaptive:
+            self._adaptive_max = max(
+                adaptive_max or self._maxconnections or self._maxcached or 4 * mincached, mincached)
+            self._adaptive_window = adaptive_window
+            self._adaptive_headroom = adaptive_headroom
+            self._adaptive_hysteresis = adaptive_hysteresis
+            # 每次维护记录一条 (时间, 期间的最大需求, 期间的取连接数, 期间需要等待的取连接数)
+            self._demand_window = deque()
+            self._peak_demand = 0
+            self._adapt_checkouts = 0
+            self._adapt_waits = 0
+            self._last_shrink = time.monotonic()
+        self._warmup_parallelism = max(warmup_parallelism or 1, 1)
+        self._opening = 0  # 正在后台建立的连接数
+        self._maintenance_stop = Event()
+        self._maintenance_thread = None
         # 建立初始数量的空闲数据库连接
-        idle = [self.dedicated_connection() for i in range(mincached)]
-        while idle:
-            idle.pop().close()
+        self._reserve_idle(mincached)
+        if warmup_deferred:
+            Thread(target=self._deferred_warm_up, args=(mincached,), name="pooled-db-warmup", daemon=True).start()
+        else:
+            error = self._open_idle(mincached)
+            if error is not None:
+                self.close()
+                raise error
+        intervals = [t for t in (idle_timeout, max_lifetime, health_check_interval) if t]
+        if adaptive:
+            intervals.append(adaptive_window / 10)
+        if intervals:
+            if not maintenance_interval:
+                maintenance_interval = min(max(min(intervals) / 2, 1), 30)
+            self._start_maintenance(maintenance_interval)
 
     def steady_connection(self):
         """获取稳定的非池化DB连接."""
-        return connect(
+        con = connect(
             self._creator, self._maxusage, self._setsession,
             self._failures, self._ping, True, *self._args, **self._kwargs)
+        # 新建的连接视为刚检查过, _lifetime_factor 用于计算随机提前的生命周期
+        con._validated = con._created
+        con._idle_since = con._created
+        con._lifetime_factor = 1 - self._lifetime_jitter * random.random()
+        return con
+
+    def _check_out(self, con):
+        """检查从空闲缓存取出的连接, 后台最近检查过的连接跳过 ping."""
+        if (self._health_check_interval
+                and time.monotonic() - con._validated < self._health_check_interval):
+            return
+        con._ping_check()
+
+    def _expired(self, con, now):
+        """连接是否超过了最长生命周期."""
+        return bool(self._max_lifetime) and now - con._created >= self._max_lifetime * con._lifetime_factor
 
     def connection(self, shareable=True):
         """从池中获取稳定的缓存 DB连接.如果设置了可共享并且底层 DB允许它，
@@ -117,96 +229,152 @@ class PooledDB:
         """
         if shareable and self._maxshared:
             with self._lock:
-                while (not self._shared_cache and self._maxconnections
-                        and self._connections >= self._maxconnections):
-                    self._wait_lock()
+                self._wait_lock(self._shared_unavailable)
                 if len(self._shared_cache) < self._maxshared:
                     # 共享缓存未满，获取专用连接
                     try:  # 首先尝试从空闲缓存中获取它
-                        con = self._idle_cache.pop(0)
+                        con = self._idle_cache.pop()
                     except IndexError:  # 否则获得新的连接
                         con = self.steady_connection()
                     else:
-                        con._ping_check()  # 检查此连接
+                        self._check_out(con)  # 检查此连接
                     con = SharedDBConnection(con)
                     self._connections += 1
+                    self._track_demand()
+                    self._shared_cache[id(con)] = con
                 else:  # 共享缓存已满或不允许更多连接
-                    self._shared_cache.sort()  # 最少共享连接优先
-                    con = self._shared_cache.pop(0)
-                    while con.con._transaction:
-                        # 不要共享事务中的连接
-                        self._shared_cache.insert(0, con)
-                        self._wait_lock()
-                        self._shared_cache.sort()
-                        con = self._shared_cache.pop(0)
+                    # 最少共享连接优先, 等待时已确认不在事务中
+                    con = self._pop_least_shared()
                     con.con._ping_check()  # 检查底层连接
                     con.share()  # 将此链接共享
-                # 将连接（放回）共享缓存中
-                self._shared_cache.append(con)
-                self._lock.notify()
+                # 将连接（放回）共享堆中
+                self._push_shared(con)
+                self._checkouts += 1
+                self._notify()
             con = PooledSharedDBConnection(self, con)
         else:  # 尝试获取专用连接
             with self._lock:
-                while (self._maxconnections
-                        and self._connections >= self._maxconnections):
-                    self._wait_lock()
-                # 未达到连接限制，获取专用连接
+                self._wait_lock(self._dedicated_unavailable)
+                # 未达到连接限制，先占用名额，建立连接和 ping 在锁外进行
+                self._connections += 1
+                self._checkouts += 1
+                self._track_demand()
                 try:  # 首先尝试从空闲缓存中获取它
-                    con = self._idle_cache.pop(0)
-                except IndexError:  # 否则获得新的连接
+                    con = self._idle_cache.pop()
+                except IndexError:
+                    con = None
+            try:
+                if con is None:  # 否则获得新的连接
                     con = self.steady_connection()
                 else:
-                    con._ping_check()  # 检查连接
-                con = PooledDedicatedDBConnection(self, con)
-                self._connections += 1
+                    self._check_out(con)  # 检查连接
+            except BaseException:
+                with self._lock:  # 释放占用的名额
+                    self._connections -= 1
+                    self._notify()
+                raise
+            con = PooledDedicatedDBConnection(self, con)
         return con
 
     def dedicated_connection(self):
         return self.connection(False)
 
+    def _push_shared(self, con):
+        """按连接当前的事务状态和共享数压入共享堆, 之前的条目失效."""
+        con.version += 1
+        heapq.heappush(self._shared_heap, (
+            bool(con.con._transaction), con.shared, next(self._shared_seq), con.version, con))
+        if len(self._shared_heap) > 2 * len(self._shared_cache) + 16:
+            # 失效条目过多时重建
+            self._rebuild_shared_heap()
+
+    def _rebuild_shared_heap(self):
+        self._shared_heap = [
+            (bool(con.con._transaction), con.shared, next(self._shared_seq), con.version, con)
+            for con in self._shared_cache.values()
+        ]
+        heapq.heapify(self._shared_heap)
+
+    def _stale_shared(self, entry):
+        """共享堆中的条目已失效: 连接之后重新压入过, 或已经不在共享缓存中."""
+        con = entry[-1]
+        return entry[3] != con.version or self._shared_cache.get(id(con)) is not con
+
+    def _pop_least_shared(self):
+        """弹出不在事务中且共享数最少的连接, 调用方需要持有锁且共享缓存不为空."""
+        rebuilt = False
+        while True:
+            if not self._shared_heap:
+                self._rebuild_shared_heap()
+            entry = heapq.heappop(self._shared_heap)
+            if self._stale_shared(entry):
+                continue
+            transaction, shared, _, _, con = entry
+            if transaction != bool(con.con._transaction) or shared != con.shared:
+                # 事务状态在池外变化, 按当前状态重新压入
+                self._push_shared(con)
+                continue
+            if transaction and not rebuilt:
+                # 堆顶在事务中时, 其他连接的事务可能已经结束, 按当前状态重建后再判断
+                self._rebuild_shared_heap()
+                rebuilt = True
+                continue
+            return con
+
     def unshare(self, con):
         """减少共享缓存中连接的份额."""
         with self._lock:
             con.unshare()
             shared = con.shared
             if not shared:  # 连接处于空闲状态
-                try:  # 尝试删除它
-                    self._shared_cache.remove(con)  # 从共享缓存
-                except ValueError:
-                    pass  # 连接池已经关闭
+                # 从共享缓存删除, 堆中的条目在弹出时丢弃, 连接池已经关闭时不存在
+                self._shared_cache.pop(id(con), None)
+            elif self._shared_cache.get(id(con)) is con:
+                self._push_shared(con)
+            self._notify()
         if not shared:  # 连接已变为空闲状态
             self.cache(con.con)  # 因此将其添加到空闲缓存中
 
     def cache(self, con):
         """将专用连接放回空闲缓存中."""
+        # 连接此时只属于当前线程, 回滚和关闭在锁外进行
+        now = time.monotonic()
+        reset = ((not self._maxcached or len(self._idle_cache) < self._maxcached)
+                 and not self._expired(con, now))
+        if reset:
+            con._reset(force=self._reset)  # 回滚可能的事务
         with self._lock:
-            if not self._maxcached or len(self._idle_cache) < self._maxcached:
-                con._reset(force=self._reset)  # 回滚可能的事务
+            if reset and (not self._maxcached or len(self._idle_cache) < self._maxcached):
                 # 空闲缓存未满，所以把它放在那里
+                con._idle_since = now
                 self._idle_cache.append(con)  # 将其追加到空闲缓存
-            else:  # 如果空闲缓存已满
-                con.close()  # 然后关闭连接
+                con = None
             self._connections -= 1
-            self._lock.notify()
+            self._notify()
+        if con is not None:  # 如果空闲缓存已满
+            con.close()  # 然后关闭连接
 
     def close(self):
         """关闭池中的所有连接"""
+        self._maintenance_stop.set()
         with self._lock:
             while self._idle_cache:  # 关闭所有空闲连接
-                con = self._idle_cache.pop(0)
+                con = self._idle_cache.popleft()
                 try:
                     con.close()
                 except Exception:
                     pass
             if self._maxshared:  # 关闭所有共享连接
                 while self._shared_cache:
-                    con = self._shared_cache.pop(0).con
+                    con = self._shared_cache.popitem()[1].con
                     try:
                         con.close()
                     except Exception:
                         pass
                     self._connections -= 1
-            self._lock.notify_all()
+                self._shared_heap = []
+            for waiter in self._waiters:
+                waiter.notify()
 
     def __del__(self):
         """删除池"""
@@ -215,11 +383,278 @@ class PooledDB:
         except Exception:  # 内置异常可能不再存在
             pass
 
-    def _wait_lock(self):
-        """内置异常可能不再存在."""
+    def _dedicated_unavailable(self):
+        """已达到连接限制."""
+        return self._maxconnections and self._connections >= self._maxconnections
+
+    def _shared_unavailable(self):
+        """没有可以共享的连接: 共享缓存为空且已达到连接限制, 或共享缓存已满且都在事务中."""
+        if len(self._shared_cache) < self._maxshared:
+            return not self._shared_cache and self._dedicated_unavailable()
+        # 只查看堆顶, 不弹出有效条目: 先丢弃堆顶的失效条目, 堆顶不在事务中时就有可用连接
+        heap = self._shared_heap
+        while heap and self._stale_shared(heap[0]):
+            heapq.heappop(heap)
+        if heap and not heap[0][4].con._transaction:
+            return False
+        # 堆顶在事务中时, 其他连接的事务可能已经在池外结束, 按当前状态判断
+        return all(con.con._transaction for con in self._shared_cache.values())
+
+    def _wait_lock(self, unavailable):
+        """在持有锁时调用, 连接不可用或前面有等待者时按先来后到排队等待.
+
+        不阻塞时抛出 TooManyConnections, 等待超过 checkout_timeout 时抛出 CheckoutTimeout.
+        """
+        if not self._waiters and not unavailable():
+            return
         if not self._blocking:
             raise TooManyConnections
-        self._lock.wait()
+        waiter = Condition(self._lock)
+        self._waiters.append(waiter)
+        self._track_demand()
+        self._waits += 1
+        if len(self._waiters) > self._max_waiting:
+            self._max_waiting = len(self._waiters)
+        start = time.monotonic()
+        deadline = start + self._checkout_timeout if self._checkout_timeout else None
+        try:
+            while self._waiters[0] is not waiter or unavailable():
+                if deadline is None:
+                    waiter.wait()
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise CheckoutTimeout(
+                        "等待可用连接超过%s秒, 排队%d个" % (self._checkout_timeout, len(self._waiters)))
+                waiter.wait(remaining)
+        finally:
+            if self._waiters[0] is waiter:
+                self._waiters.popleft()
+            else:
+                self._waiters.remove(waiter)
+            self._record_wait(time.monotonic() - start)
+            # 轮到下一个等待者检查
+            self._notify()
+
+    def _track_demand(self):
+        """自适应时记录使用中加排队的连接数的峰值."""
+        if self._adaptive:
+            demand = self._connections + len(self._waiters)
+            if demand > self._peak_demand:
+                self._peak_demand = demand
+
+    def _notify(self):
+        """唤醒队首的等待者."""
+        if self._waiters:
+            self._waiters[0].notify()
+
+    def _record_wait(self, seconds):
+        self._wait_time += seconds
+        for i, bound in enumerate(WAIT_BUCKETS):
+            if seconds <= bound:
+                self._wait_histogram[i] += 1
+                return
+        self._wait_histogram[-1] += 1
+
+    def stats(self):
+        """连接池的使用情况和取连接的等待统计."""
+        with self._lock:
+            histogram = {"<=%s" % bound: n for bound, n in zip(WAIT_BUCKETS, self._wait_histogram)}
+            histogram[">%s" % WAIT_BUCKETS[-1]] = self._wait_histogram[-1]
+            return {
+                "connections": self._connections,
+                "idle": len(self._idle_cache),
+                "shared": len(self._shared_cache) if self._maxshared else 0,
+                "maxconnections": self._maxconnections,
+                "waiting": len(self._waiters),
+                "max_waiting": self._max_waiting,
+                "checkouts": self._checkouts,
+                "waits": self._waits,
+                "timeouts": self._timeouts,
+                "wait_time": self._wait_time,
+                "wait_histogram": histogram,
+                "reaped": self._reaped,
+                "recycled": self._recycled,
+                "health_failures": self._health_failures,
+                "warm": self._warm,
+            }
+
+    def _start_maintenance(self, interval):
+        """启动后台维护线程, 线程只持有池的弱引用, 池被回收或关闭后线程退出."""
+        self._maintenance_thread = Thread(
+            target=_maintenance_loop, args=(weakref.ref(self), self._maintenance_stop, interval),
+            name="pooled-db-maintenance", daemon=True)
+        self._maintenance_thread.start()
+
+    def maintain(self):
+        """关闭空闲超时和超过生命周期的空闲连接, 检查空闲连接, 并补足 mincached 个空闲连接.
+
+        由后台线程定期调用, 检查和建立连接在锁外进行, 期间这些连接不在空闲缓存中.
+        """
+        now = time.monotonic()
+        closing, checking = [], []
+        with self._lock:
+            if self._adaptive:
+                self._adapt(now)
+            keep = deque()
+            idle = len(self._idle_cache)
+            # 自适应时关闭超出保持数的空闲连接
+            excess = idle + self._connections - self._warm if self._adaptive else 0
+            # 从左端开始是最久未使用的连接
+            for con in self._idle_cache:
+                if self._expired(con, now):
+                    closing.append(con)
+                    self._recycled += 1
+                    idle -= 1
+                    excess -= 1
+                elif (excess > 0 or self._idle_timeout and idle > self._warm
+                        and now - con._idle_since >= self._idle_timeout):
+                    closing.append(con)
+                    self._reaped += 1
+                    idle -= 1
+                    excess -= 1
+                elif (self._health_check_interval
+                        and now - con._validated >= self._health_check_interval):
+                    checking.append(con)
+                else:
+                    keep.append(con)
+            self._idle_cache = keep
+
+        for con in closing:
+            con.close()
+        for con in checking:
+            if self._health_check(con):
+                self._put_idle(con)
+            else:
+                con.close()
+                with self._lock:
+                    self._health_failures += 1
+        self._replenish()
+
+    def _adapt(self, now):
+        """在持有锁时调用, 按滑动窗口内的最大需求和等待情况调整保持的连接数.
+
+        需求增加时立即扩大; 窗口内需要等待的取连接超过 ADAPTIVE_WAIT_RATIO 时,
+        即使并发没有增加也在当前保持数之上扩大; 需求比当前保持数少 adaptive_hysteresis 以上,
+        没有等待, 且距上次缩小超过一个窗口时才缩小.
+        """
+        window = self._demand_window
+        window.append((now, self._peak_demand, self._checkouts - self._adapt_checkouts,
+                       self._waits - self._adapt_waits))
+        self._peak_demand = self._connections + len(self._waiters)
+        self._adapt_checkouts = self._checkouts
+        self._adapt_waits = self._waits
+        while window and window[0][0] < now - self._adaptive_window:
+            window.popleft()
+
+        demand = max(item[1] for item in window)
+        checkouts = sum(item[2] for item in window)
+        waits = sum(item[3] for item in window)
+        waiting = checkouts and waits / checkouts > ADAPTIVE_WAIT_RATIO
+        target = math.ceil(demand * (1 + self._adaptive_headroom))
+        if waiting:
+            target = max(target, self._warm + max(1, math.ceil(self._warm * self._adaptive_headroom)))
+        target = min(max(target, self._mincached), self._adaptive_max)
+        if target > self._warm:
+            logger.info("连接池保持数 %d -> %d, 需求%d, 等待%d/%d" % (self._warm, target, demand, waits, checkouts))
+            self._warm = target
+        elif (not waits and target < self._warm * (1 - self._adaptive_hysteresis)
+                and now - self._last_shrink >= self._adaptive_window):
+            logger.info("连接池保持数 %d -> %d, 需求%d, 等待%d/%d" % (self._warm, target, demand, waits, checkouts))
+            self._warm = target
+            self._last_shrink = now
+
+    def _health_check(self, con):
+        """在锁外执行 health_check_sql, 成功时更新检查时间."""
+        try:
+            cursor = con._con.cursor()
+            try:
+                cursor.execute(self._health_check_sql)
+                cursor.fetchall()
+            finally:
+                cursor.close()
+            if not getattr(con._con, "autocommit", False):
+                con._con.rollback()
+        except Exception as e:
+            logger.warning("连接检查失败, 关闭连接: %s" % str(e))
+            return False
+        con._validated = time.monotonic()
+        return True
+
+    def _replenish(self):
+        """空闲连接少于保持数时建立新的连接."""
+        with self._lock:
+            missing = self._warm - len(self._idle_cache) - self._connections - self._opening
+            self._reserve_idle(missing)
+        error = self._open_idle(missing)
+        if error is not None:
+            logger.warning("补充空闲连接失败: %s" % str(error))
+
+    def _deferred_warm_up(self, n):
+        error = self._open_idle(n)
+        if error is not None:
+            logger.error("建立初始连接失败: %s" % str(error))
+
+    def _reserve_idle(self, n):
+        """记录将要建立的连接数, 避免后台补充时重复建立."""
+        with self._lock:
+            self._opening += max(n, 0)
+
+    def _open_idle(self, n):
+        """建立 n 个连接放入空闲缓存, 最多同时建立 warmup_parallelism 个, 返回第一个异常.
+
+        调用前需要用 _reserve_idle 记录, 顺序建立时遇到异常就停止.
+        """
+        if n <= 0:
+            return None
+
+        def open_one():
+            try:
+                con = self.steady_connection()
+            finally:
+                with self._lock:
+                    self._opening -= 1
+            self._put_idle(con)
+
+        workers = min(self._warmup_parallelism, n)
+        if workers == 1:
+            for i in range(n):
+                try:
+                    open_one()
+                except Exception as e:
+                    with self._lock:
+                        self._opening -= n - i - 1
+                    return e
+            return None
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pooled-db-warmup") as executor:
+            futures = [executor.submit(open_one) for _ in range(n)]
+        for future in futures:
+            if future.exception() is not None:
+                return future.exception()
+        return None
+
+    def _put_idle(self, con):
+        """把后台检查或建立的连接放回空闲缓存左端, 不改变最近使用的连接优先的顺序, 池已关闭时关闭连接."""
+        with self._lock:
+            if not self._maintenance_stop.is_set():
+                self._idle_cache.appendleft(con)
+                self._notify()
+                return
+        con.close()
+
+
+def _maintenance_loop(pool_ref, stop, interval):
+    while not stop.wait(interval):
+        pool = pool_ref()
+        if pool is None:
+            return
+        try:
+            pool.maintain()
+        except Exception:
+            logger.exception("连接池维护失败")
+        del pool
 
 
 # 池连接的辅助类
@@ -280,6 +715,8 @@ class SharedDBConnection:
         """
         self.con = con
         self.shared = 1
+        # 每次压入共享堆时递增, 堆中版本不一致的条目已失效
+        self.version = 0
 
     def __lt__(self, other):
         if self.con._transaction == other.con._transaction:
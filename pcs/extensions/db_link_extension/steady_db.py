@@ -1,4 +1,5 @@
 import sys
+import time
 
 
 class SteadyDBError(Exception):
@@ -198,6 +199,7 @@ class SteadyDBConnection:
         self._transaction = False
         self._closed = False
         self._usage = 0
+        self._created = time.monotonic()  # 建立时间, 重新连接时更新
 
     def _close(self):
         """关闭链接.
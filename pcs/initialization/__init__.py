@@ -4,6 +4,7 @@ from pcs.common.errors import DBError, DBCreateError, DBUpdateError, DBDeleteErr
 from pcs.extensions.db_link_extension.pooled_db import PooledDB
 from flask_jwt_extended import JWTManager
 from flask.logging import default_handler
+from concurrent.futures import ThreadPoolExecutor
 import logging
 import logging.handlers
 import psycopg2
@@ -37,8 +38,11 @@ class Initializer:
         self.register_error_handler()
         self.init_db()
         self.init_table()
+        self.init_tables_info()
+        self.init_audit_buffers()
         self.init_jwt()
         self.init_hook()
+        self.init_cli()
         self.post_init()
 
     def register_blueprints(self):
@@ -61,7 +65,7 @@ class Initializer:
         if "main" not in db_conf.keys():
             raise "未配置main数据库"
 
-        db_pool = self.pcs_app.db_pool
+        pools_conf = {}
         for name, conf in db_conf.items():
             self.pcs_app.dbs_conf[name] = conf.copy()
             db_type = conf.pop("db_type", None)
@@ -70,19 +74,33 @@ class Initializer:
                 continue
 
             if db_type == "postgresql":
-                creator = psycopg2
-
-                try:
-                    db_pool[name] = PooledDB(creator=creator, **conf)
-                except Exception as e:
-                    logger.error("连接数据库失败'{0}'".format(str(e)))
-                    raise Exception("连接数据库失败'{0}'".format(str(e)))
+                pools_conf[name] = (psycopg2, conf)
             # elif db_type == "mysql":
             #     creator = pymysql
             # elif db_type == "redis":
             #     creator = redis
             else:
                 continue
+
+        # 各数据库的连接池同时建立初始连接
+        db_pool = self.pcs_app.db_pool
+        with ThreadPoolExecutor(max_workers=max(len(pools_conf), 1), thread_name_prefix="init-db") as executor:
+            futures = {
+                name: executor.submit(PooledDB, creator=creator, **conf)
+                for name, (creator, conf) in pools_conf.items()
+            }
+        error = None
+        for name, future in futures.items():
+            try:
+                db_pool[name] = future.result()
+            except Exception as e:
+                logger.error("连接数据库[{0}]失败'{1}'".format(name, str(e)))
+                error = error or e
+        if error is not None:
+            # 关闭已建立的连接池, 停止其后台线程
+            for name in list(db_pool.keys()):
+                db_pool.pop(name).close()
+            raise Exception("连接数据库失败'{0}'".format(str(error)))
         logger.info("连接数据库成功")
         return None
 
@@ -103,6 +121,74 @@ class Initializer:
                 module.db_type = conf.get("db_type")
                 self.pcs_app.add_table(module)
 
+    def init_tables_info(self):
+        tables = self.pcs_app.tables
+        schema_check_interval = self.pcs_app.config.get("SCHEMA_CHECK_INTERVAL")
+        if schema_check_interval is not None:
+            tables.schema_check_interval = schema_check_interval
+
+        for db_name in self.pcs_app.db_pool.keys():
+            if not tables.get_db_tables(db_name):
+                continue
+
+            conn = self.pcs_app.get_db_connect(db_name)
+            cur = conn.cursor()
+            try:
+                tables.load_tables_info(cur, db_name)
+            except Exception as e:
+                logger.error("加载数据库[{0}]表结构失败'{1}'".format(db_name, str(e)))
+            finally:
+                cur.close()
+                conn.close()
+
+    def init_audit_buffers(self):
+        """为 write_behind 的表创建后写缓冲, 配置 AUDIT_BUFFER_ENABLE = False 时同步写入"""
+        from pcs.common.audit_buffer import AuditBuffer
+        from pcs.common.enum.system_enum import BufferOverflowPolicy
+
+        config = self.pcs_app.config
+        if config.get("AUDIT_BUFFER_ENABLE") is False:
+            return None
+
+        for name, table_class in self.pcs_app.tables.tables.items():
+            if not table_class.write_behind:
+                continue
+
+            table_class.write_buffer = AuditBuffer(
+                self.pcs_app, name,
+                batch_size=config.get("AUDIT_BUFFER_BATCH_SIZE") or 500,
+                flush_interval=float(config.get("AUDIT_BUFFER_FLUSH_INTERVAL") or 1.0),
+                max_size=config.get("AUDIT_BUFFER_MAX_SIZE") or 10000,
+                overflow=config.get("AUDIT_BUFFER_OVERFLOW") or BufferOverflowPolicy.BLOCK.value,
+            )
+            logger.info("表[%s]使用后写缓冲" % table_class.table_name)
+
+    def init_cli(self):
+        import click
+        from pcs.common.table_maintenance import purge_expired_tables, ensure_partitions_tables, PURGE_BATCH_SIZE, \
+            PURGE_SLEEP
+
+        pcs_app = self.pcs_app
+
+        @pcs_app.cli.command('purge-expired')
+        @click.option('--table', 'table_names', multiple=True, help="Table类名, 可重复, 默认全部设置了保留期限的表")
+        @click.option('--batch-size', default=PURGE_BATCH_SIZE, show_default=True, help="每批删除的行数")
+        @click.option('--sleep', default=PURGE_SLEEP, show_default=True, help="每批之间暂停的秒数")
+        @click.option('--max-batches', default=None, type=int, help="每个表最多执行的批数")
+        def purge_expired(table_names, batch_size, sleep, max_batches):
+            """清理超过保留期限的数据"""
+            results = purge_expired_tables(pcs_app, table_names=list(table_names), batch_size=batch_size,
+                                           sleep=sleep, max_batches=max_batches)
+            for result in results:
+                click.echo(json.dumps(result, ensure_ascii=False))
+
+        @pcs_app.cli.command('ensure-partitions')
+        @click.option('--table', 'table_names', multiple=True, help="Table类名, 可重复, 默认全部声明了分区字段的表")
+        def ensure_partitions(table_names):
+            """创建分区表当前和之后的分区"""
+            for result in ensure_partitions_tables(pcs_app, table_names=list(table_names)):
+                click.echo(json.dumps(result, ensure_ascii=False))
+
     def init_jwt(self):
         jwt.init_app(self.pcs_app)
 
@@ -4,4 +4,5 @@ from pcs.common.base import BaseTable
 class UserTable(BaseTable):
     table_name = 'user_list'
     # primary_keys = ("id",)
+    deferred_columns = ("password",)
 
@@ -3,9 +3,16 @@ from pcs.common.base import BaseTable
 
 class UserLogTable(BaseTable):
     table_name = 'user_log_list'
+    retention_field = 'create_date'
+    retention_days = 180
+    partition_field = 'create_date'
+    write_behind = True
 
-    def add_user_log(self, user_id, log_type, log_content):
+    def add_user_log(self, user_id, log_type, log_content, deferred=True):
+        """deferred 为 False 时在当前事务中同步写入, 日志需要随业务数据一起提交或回滚时使用"""
         log_data = {
             "user_id": user_id, "log_type": log_type,  "log_content": log_content
         }
-        return self.create(log_data)
+        if not deferred:
+            return self.create(log_data)
+        return self.create_deferred(log_data)
@@ -6,17 +6,21 @@ from datetime import datetime
 
 class UserLoginTable(BaseTable):
     table_name = 'user_login_list'
+    retention_field = 'login_time'
+    retention_days = 90
+    partition_field = 'login_time'
+    write_behind = True
 
     def user_login(self):
         login_data = {
             "user_id": self.user_id, "login_type": LoginType.Login.value, "login_time": datetime.now(),
             "login_ip": self.login_ip,
         }
-        return self.create(login_data)
+        return self.create_deferred(login_data)
 
     def user_logout(self):
         login_data = {
             "user_id": self.user_id, "login_type": LoginType.Logout.value, "login_time": datetime.now(),
             "login_ip": self.login_ip,
         }
-        return self.create(login_data)
+        return self.create_deferred(login_data)
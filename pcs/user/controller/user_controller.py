@@ -61,7 +61,8 @@ class UserController(BaseController):
         user_result = user_t.create(user_data)
 
         user_id = user_result.get("id")
-        user_log_t.add_user_log(user_id, LogType.Create.value, "创建用户[{0}]成功".format(username))
+        # 注册事务回滚时不能留下日志, 因此在同一事务中同步写入
+        user_log_t.add_user_log(user_id, LogType.Create.value, "创建用户[{0}]成功".format(username), deferred=False)
         self.commit()
         return Response.success()
 
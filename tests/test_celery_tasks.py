@@ -0,0 +1,102 @@
+"""
+批量任务的幂等测试, 任务通过 PCS_CELERY_ALWAYS_EAGER 在当前进程中同步执行
+
+需要一个可以建表的 postgresql 数据库, 未设置 PCS_TEST_DB_HOST 时跳过:
+
+    PCS_TEST_DB_HOST=/tmp/pgdata PCS_TEST_DB_NAME=postgres PCS_TEST_DB_USER=postgres python -m pytest tests
+"""
+import os
+import json
+import uuid
+
+import pytest
+
+os.environ['PCS_CELERY_ALWAYS_EAGER'] = 'true'
+os.environ.setdefault('PCS_CELERY_BROKER_URL', 'memory://')
+os.environ.setdefault('PCS_CELERY_BACKEND', 'cache+memory://')
+
+pytestmark = pytest.mark.skipif(not os.environ.get('PCS_TEST_DB_HOST'), reason="未设置 PCS_TEST_DB_HOST")
+
+TEST_TABLE = 'pcs_test_task_rows'
+
+
+@pytest.fixture(scope='module')
+def app(tmp_path_factory):
+    from pcs.common.base import BaseFlaskApp, BaseTable
+    from pcs.initialization import Initializer
+    from pcs.extensions.celery_extension import tasks
+
+    class TaskRowTable(BaseTable):
+        db_name = 'main'
+        db_type = 'postgresql'
+        table_name = TEST_TABLE
+
+    db_conf = {"main": {
+        "db_type": "postgresql", "is_use": True, "host": os.environ['PCS_TEST_DB_HOST'],
+        "dbname": os.environ.get('PCS_TEST_DB_NAME', 'postgres'),
+        "user": os.environ.get('PCS_TEST_DB_USER', 'postgres'),
+        "password": os.environ.get('PCS_TEST_DB_PASSWORD'),
+        "port": os.environ.get('PCS_TEST_DB_PORT', '5432'), "mincached": 1,
+    }}
+    conf_path = tmp_path_factory.mktemp('conf') / 'db_config.json'
+    conf_path.write_text(json.dumps(db_conf))
+
+    flask_app = BaseFlaskApp(__name__)
+    flask_app.config['DB_CONF_PATH'] = str(conf_path)
+    initializer = Initializer(flask_app)
+    initializer.init_db()
+
+    conn = flask_app.get_db_connect('main', autocommit=True)
+    cur = conn.cursor()
+    cur.execute("drop table if exists %s" % TEST_TABLE)
+    cur.execute("""
+        create table %s (
+            id serial primary key, name varchar,
+            create_date timestamp, create_uid integer, write_date timestamp, write_uid integer
+        )
+    """ % TEST_TABLE)
+
+    flask_app.add_table(TaskRowTable)
+    initializer.init_tables_info()
+    tasks._flask_app = flask_app
+    yield flask_app
+
+    tasks._flask_app = None
+    cur.execute("drop table if exists %s" % TEST_TABLE)
+    cur.close()
+    conn.close()
+    for pool in flask_app.db_pool.values():
+        pool.close()
+
+
+def count_rows(app, name):
+    conn = app.get_db_connect('main', autocommit=True)
+    cur = conn.cursor()
+    try:
+        cur.execute("select count(1) from %s where name = %%s" % TEST_TABLE, (name,))
+        return cur.fetchone()[0]
+    finally:
+        cur.close()
+        conn.close()
+
+
+def test_same_chunk_key_applied_once(app):
+    from pcs.extensions.celery_extension import pcs_celery_app
+    from pcs.extensions.celery_extension.enqueue import enqueue_batch_create
+
+    assert pcs_celery_app.conf.task_always_eager
+    name = uuid.uuid4().hex
+    key = 'test-%s' % name
+
+    def rows():
+        return [{"name": name} for _ in range(5)]
+
+    enqueue_batch_create('TaskRowTable', rows(), chunk_size=2, idempotency_key=key)
+    assert count_rows(app, name) == 5
+
+    # 同一个幂等键重新投递(如 worker 退出后重新投递), 已执行的块不重复写入
+    enqueue_batch_create('TaskRowTable', rows(), chunk_size=2, idempotency_key=key)
+    assert count_rows(app, name) == 5
+
+    enqueue_batch_create('TaskRowTable', rows(), chunk_size=2, idempotency_key=key + '-new')
+    assert count_rows(app, name) == 10